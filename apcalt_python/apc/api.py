@@ -1,24 +1,138 @@
-import json
+import asyncio
+import re
 from math import ceil
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, cast
 
-from ..decorator import cached
+from quart import current_app
+
+from .. import jsoncodec
+from ..decorator import cache_key, cached, prefetch, prime, shared_key, single_flight
 from ..exceptions import BusinessError
 from ..learnosity.assignment import Assignment
 from ..learnosity.request import make_signed_request
 from ..log import get_logger as _logger
 from ..request import get_session as _sess
+from ..sessions import BaseSessionInterface
 
 if TYPE_CHECKING:
     from .auth import APCAuth
 
 
+_OPERATION = re.compile(r'\s*(query|mutation)\s+(\w+)\s*(?:\(([^)]*)\))?\s*\{')
+_VARIABLE = re.compile(r'\$(\w+)')
+
+_ASSIGNMENT_PLAYER = 'query assignmentPlayer($a:String,$s:String){assignmentPlayer(assignmentId:$a,isImpersonating:false,subjectId:$s,config:\"{}\"){learnositySignedRequest}}'
+_ASSIGNMENT_SESSION = 'query assignmentSession($a:Int){assignmentSession(assignmentId:$a,isImpersonating:false){timedSession{timeElapsed totalTime submissionStatus}}}'
+
+# how long to remember that the student has opened an assignment here
+_OPENED_EXPIRY = 60 * 60 * 24 * 30
+
+
+class GraphQLError(ValueError):
+    def __init__(self, operation: str, errors: list[Any]):
+        self.operation = operation
+        self.errors = errors
+        super().__init__('GraphQL operation %s failed: %s' % (operation, errors))
+
+
+def _split_operation(query: str) -> tuple[str, str, str, str]:
+    # -> (kind, variable definitions, top-level selection, trailing fragments)
+    match = _OPERATION.match(query)
+    if match is None:
+        raise ValueError('Cannot batch GraphQL document: %s' % query)
+    depth = 1
+    in_string = False
+    index = match.end()
+    while depth:
+        if index == len(query):
+            raise ValueError('Unbalanced GraphQL document: %s' % query)
+        char = query[index]
+        if in_string:
+            if char == '\\':
+                index += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        index += 1
+    selection = query[match.end() : index - 1].strip()
+    return match[1], match[3] or '', selection, query[index:].strip()
+
+
+def _merge_operations(
+    operations: list[tuple[str, str, dict[str, Any] | None]]
+) -> tuple[str, str, dict[str, Any]]:
+    # Each operation's top-level field is aliased o<i> and its variables are
+    # renamed $o<i>_<name>, so that they can share a single document.
+    kinds = set()
+    definitions = []
+    selections = []
+    fragments: dict[str, None] = {}
+    variables: dict[str, Any] = {}
+    for index, (_, query, op_variables) in enumerate(operations):
+        kind, defs, selection, trailing = _split_operation(query)
+        kinds.add(kind)
+        rename = rf'$o{index}_\1'
+        if defs:
+            definitions.append(_VARIABLE.sub(rename, defs))
+        selections.append(f'o{index}:' + _VARIABLE.sub(rename, selection))
+        if trailing:
+            fragments[trailing] = None
+        for name, value in (op_variables or {}).items():
+            variables[f'o{index}_{name}'] = value
+    if len(kinds) != 1:
+        raise ValueError('Cannot batch queries and mutations together')
+    name = '_'.join(operation for operation, _, _ in operations)
+    document = '%s %s%s{%s}%s' % (
+        kinds.pop(),
+        name,
+        '(%s)' % ','.join(definitions) if definitions else '',
+        ' '.join(selections),
+        ' '.join(fragments),
+    )
+    return name, document, variables
+
+
+def _outline_node(node: dict[str, Any], children: str | None = None) -> Any:
+    # a unit or subunit without its resources (and children), but with counts
+    slim = {
+        key: value for key, value in node.items() if key not in ('resources', children)
+    }
+    if 'resources' in node:
+        slim['resourceCount'] = len(node['resources'] or ())
+    if children is not None:
+        slim[children[:-1] + 'Count'] = len(node[children] or ())
+    return slim
+
+
+def _find_outline_node(nodes: list[Any], id_key: str, id: str) -> Any:
+    for node in nodes or ():
+        if str(node[id_key]) == id:
+            return node
+    raise BusinessError('Not found', 404)
+
+
 class APClassroom:
     __slots__ = ('_auth',)
 
     def __init__(self, auth: 'APCAuth') -> None:
         self._auth = auth
 
+    async def _gql_request(self, data: dict[str, Any], endpoint: str) -> Any:
+        sess = _sess()
+        async with sess.post(
+            'https://apc-api-production.collegeboard.org/%s/graphql' % endpoint,
+            json=data,
+            headers={'Authorization': 'Bearer ' + await self._auth.access_token()},
+            idempotent=data['query'].startswith('query'),
+            trace_name=data['operationName'],
+        ) as r:
+            return await r.json()
+
     async def _gql(
         self,
         operation: str,
@@ -29,24 +143,98 @@ class APClassroom:
         data: dict[str, Any] = {'operationName': operation, 'query': query}
         if variables is not None:
             data['variables'] = variables
-        sess = _sess()
-        async with sess.post(
-            'https://apc-api-production.collegeboard.org/%s/graphql' % endpoint,
-            json=data,
-            headers={'Authorization': 'Bearer ' + await self._auth.access_token()},
-        ) as r:
-            resp = await r.json()
+        resp = await self._gql_request(data, endpoint)
         if 'data' not in resp:
             _logger().error('GraphQL request (%s) failed. Response: %s', data, resp)
             raise ValueError('No data in GraphQL request: %s' % resp)
         return resp['data'][operation]
 
+    async def _gql_batch(
+        self,
+        operations: list[tuple[str, str, dict[str, Any] | None]],
+        endpoint: str = 'fym',
+        return_exceptions: bool = False,
+    ) -> list[Any]:
+        # Runs several (operation, query, variables) in one request and returns
+        # their results in order. An operation that failed raises GraphQLError,
+        # or has it in its place with return_exceptions.
+        name, document, variables = _merge_operations(operations)
+        data = {'operationName': name, 'query': document, 'variables': variables}
+        resp = await self._gql_request(data, endpoint)
+        results = resp.get('data') or {}
+        errors: dict[str, list[Any]] = {}
+        for error in resp.get('errors', ()):
+            path = error.get('path') or ('',)
+            errors.setdefault(str(path[0]), []).append(error)
+        if 'data' not in resp:
+            _logger().error('GraphQL request (%s) failed. Response: %s', data, resp)
+        values = []
+        for index, (operation, _, _) in enumerate(operations):
+            alias = f'o{index}'
+            value = results.get(alias)
+            op_errors = errors.get(alias, [])
+            if value is None and (op_errors or alias not in results):
+                value = GraphQLError(operation, op_errors or errors.get('', []))
+                if not return_exceptions:
+                    raise value
+            elif op_errors:
+                _logger().warning(
+                    'GraphQL %s returned errors: %s', operation, op_errors
+                )
+            values.append(value)
+        return values
+
+    @cached(
+        lambda self: f'subjects.{self._auth.user_id}', 60 * 60 * 24, stale_after=60 * 10
+    )
     async def get_subjects(self) -> Any:
         return await self._gql(
             'studentSubjects', 'query studentSubjects{studentSubjects{id name}}'
         )
 
     async def get_outline(self, subject_id: str) -> Any:
+        # the outline is cached once per subject for everyone, so make sure this
+        # user is actually enrolled before handing it out
+        subjects = await self.get_subjects()
+        if not any(str(subject['id']) == subject_id for subject in subjects):
+            raise BusinessError('Subject not found', 404)
+        return await self._get_outline(subject_id)
+
+    async def get_outline_slim(
+        self, subject_id: str, offset: int = 0, limit: int | None = None
+    ) -> Any:
+        outline = await self.get_outline(subject_id)
+        units = outline['units']
+        offset = max(offset, 0)
+        end = None if limit is None else offset + limit
+        return {
+            **_outline_node(outline, 'units'),
+            'units': [_outline_node(unit, 'subunits') for unit in units[offset:end]],
+        }
+
+    async def get_outline_unit(self, subject_id: str, unit_id: str) -> Any:
+        unit = _find_outline_node(
+            (await self.get_outline(subject_id))['units'], 'unitId', unit_id
+        )
+        return {
+            **unit,
+            'subunits': [_outline_node(subunit) for subunit in unit['subunits']],
+        }
+
+    async def get_outline_subunit(
+        self, subject_id: str, unit_id: str, subunit_id: str
+    ) -> Any:
+        unit = _find_outline_node(
+            (await self.get_outline(subject_id))['units'], 'unitId', unit_id
+        )
+        return _find_outline_node(unit['subunits'], 'subunitId', subunit_id)
+
+    @cached(
+        lambda self, subject_id: shared_key('outline', subject_id),
+        60 * 60 * 24,
+        stale_after=60 * 30,
+    )
+    async def _get_outline(self, subject_id: str) -> Any:
         return await self._gql(
             'courseOutline',
             'query courseOutline($s:String){courseOutline(subjectId:$s){id:subjectId educationPeriod units{unitId:id displayName title description number instructionalPeriods examWeighting resources{...resourceFields __typename} subunits{subunitId:id displayName number displayNumber iconName resources{...resourceFields __typename}}}}} fragment resourceFields on Resource{id:uid resourceId:id displayName description icon ... on URLResource {url fileSize contentType} ... on SourceResource{url fileSize contentType} ... on YoutubeResource{url fileSize} ... on EmbeddedVideoResource{fileSize url videoId thumbnailUrl} ... on AssessmentResource{assessmentId resourceTypeDetails} ... on StudentPracticeResource{assessmentId} ... on GroupResource{description url} ... on PracticeQuestionsResource{questions{index accNum title libraryId subjectId itemId hasAllTopicsCovered type}}}',
@@ -54,15 +242,23 @@ class APClassroom:
             'units',
         )
 
-    async def finish_video(self, video_url, video_id) -> bool:
-        cb_person_id = self._auth.data['account']['import_id']
-        user_id = self._auth.user_id
+    @cached(
+        lambda self, video_url: shared_key('wistia', video_url),
+        60 * 60 * 24,
+        scrub=lambda media: {'duration': media['media']['duration']},
+    )
+    async def get_video_media(self, video_url: str) -> Any:
         sess = _sess()
         async with sess.get(
             'https://fast.wistia.com/embed/medias/%s.json' % video_url
         ) as r:
-            media = await r.json()
-        duration = ceil(media['media']['duration'])
+            return await r.json()
+
+    async def finish_video(self, video_url, video_id) -> bool:
+        cb_person_id = self._auth.data['account']['import_id']
+        user_id = self._auth.user_id
+        media = await self.get_video_media(video_url)
+        duration = ceil(media['duration'])
         progress = [1] * duration
         ok = await self._gql(
             'storeDailyVideoProgress',
@@ -77,6 +273,7 @@ class APClassroom:
             'https://apc-api-production.collegeboard.org/fym/media/api/signed_url',
             json={'bucket': bucket, 'key': key, 'fail_if_key_is_missing': False},
             headers={'Authorization': 'Bearer ' + await self._auth.access_token()},
+            idempotent=True,
         ) as r:
             data = await r.json()
         return data['signedUrl']
@@ -132,7 +329,7 @@ class APClassroom:
             # print(response)
             value = response.get('response') or {}
             if isinstance(value, str):
-                value = json.loads(value)
+                value = jsoncodec.loads(value)
             data[response['response_id']] = value.get('value')
         return data
 
@@ -148,6 +345,47 @@ class APClassroom:
             raise BusinessError('Subject not found', 404)
         return data['assignments']
 
+    async def get_dashboard(self, statuses: list[str], concurrency: int = 4):
+        # every subject's assignment lists in one call; a list that fails is
+        # None and its error message is reported next to it
+        subjects = await self.get_subjects()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(subject_id: str, status: str):
+            async with semaphore:
+                return await self.list_assignments(subject_id, status)
+
+        pairs = [
+            (str(subject['id']), status) for subject in subjects for status in statuses
+        ]
+        results = iter(
+            await asyncio.gather(
+                *(fetch(*pair) for pair in pairs), return_exceptions=True
+            )
+        )
+        dashboard = []
+        for subject in subjects:
+            assignments: dict[str, Any] = {}
+            errors: dict[str, str] = {}
+            for status in statuses:
+                result = next(results)
+                if isinstance(result, BaseException):
+                    if not isinstance(result, BusinessError):
+                        _logger().warning(
+                            'Failed to list %s assignments of subject %s',
+                            status,
+                            subject['id'],
+                            exc_info=result,
+                        )
+                    errors[status] = getattr(result, 'msg', None) or 'Failed'
+                    result = None
+                assignments[status] = result
+            entry = {**subject, 'assignments': assignments}
+            if errors:
+                entry['errors'] = errors
+            dashboard.append(entry)
+        return dashboard
+
     async def start_assignment(self, subject_id: str, id: str):
         data = await self._gql(
             'startAssignment',
@@ -160,17 +398,26 @@ class APClassroom:
         await self.get_assignment_raw(subject_id, id)
         return True
 
+    def opened_key(self, id: str) -> str:
+        return f'assignment.{id}.{self._auth.user_id}.opened'
+
+    async def _player_assignment(self, data: Any, id: str) -> Assignment:
+        if data is None or data.get('learnositySignedRequest') is None:
+            raise BusinessError('Cannot get assignment items')
+        signed_request = jsoncodec.loads(data['learnositySignedRequest'])
+        assignment = await Assignment.from_signed_request(signed_request)
+        # the responses now exist upstream, so loading the assignment again
+        # (e.g. to warm it up) no longer writes anything
+        cache = cast(BaseSessionInterface, current_app.session_interface)
+        await cache.set(self.opened_key(id), True, current_app, _OPENED_EXPIRY)
+        return assignment
+
     @cached(lambda self, _, id: f'assignment.{id}.{self._auth.user_id}', 60 * 30)
     async def get_assignment_raw(self, subject_id: str, id: str):
         data = await self._gql(
-            'assignmentPlayer',
-            'query assignmentPlayer($a:String,$s:String){assignmentPlayer(assignmentId:$a,isImpersonating:false,subjectId:$s,config:\"{}\"){learnositySignedRequest}}',
-            {'a': id, 's': subject_id},
+            'assignmentPlayer', _ASSIGNMENT_PLAYER, {'a': id, 's': subject_id}
         )
-        if data is None or data.get('learnositySignedRequest') is None:
-            raise BusinessError('Cannot get assignment items')
-        signed_request = json.loads(data['learnositySignedRequest'])
-        return await Assignment.from_signed_request(signed_request)
+        return await self._player_assignment(data, id)
 
     async def get_assignment(self, subject_id: str, id: str):
         return self._convert_assignment(await self.get_assignment_raw(subject_id, id))
@@ -184,13 +431,55 @@ class APClassroom:
         return self._convert_responses(responses)
 
     async def get_assignment_timed(self, subject_id: str, id: str):
-        data = await self._gql(
-            'assignmentSession',
-            'query assignmentSession($a:Int){assignmentSession(assignmentId:$a,isImpersonating:false){timedSession{timeElapsed totalTime submissionStatus}}}',
-            {'a': int(id)},
-        )
+        data = await self._gql('assignmentSession', _ASSIGNMENT_SESSION, {'a': int(id)})
         return data['timedSession']
 
+    async def open_assignment(self, subject_id: str, id: str):
+        # fetch the player and the timer in one round trip, unless the
+        # assignment is already cached
+        key = cache_key(APClassroom.get_assignment_raw, self, subject_id, id)
+        if not await prefetch(key):
+            assignment = await self.get_assignment_raw(subject_id, id)
+            timed = await self.get_assignment_timed(subject_id, id)
+            return {'assignment': self._convert_assignment(assignment), 'timed': timed}
+        batched = {}
+
+        async def load():
+            player, session = await self._gql_batch(
+                [
+                    (
+                        'assignmentPlayer',
+                        _ASSIGNMENT_PLAYER,
+                        {'a': id, 's': subject_id},
+                    ),
+                    ('assignmentSession', _ASSIGNMENT_SESSION, {'a': int(id)}),
+                ],
+                return_exceptions=True,
+            )
+            if isinstance(player, Exception):
+                raise player
+            batched['session'] = session
+            return await prime(
+                APClassroom.get_assignment_raw,
+                await self._player_assignment(player, id),
+                self,
+                subject_id,
+                id,
+            )
+
+        # shares the flight of get_assignment_raw, so concurrent opens (and
+        # plain loads) of the assignment build it only once
+        assignment = await single_flight(key, load)
+        session = batched.get('session')
+        if session is None:
+            # joined a load started elsewhere; the timer wasn't fetched
+            timed = await self.get_assignment_timed(subject_id, id)
+        elif isinstance(session, Exception):
+            raise session
+        else:
+            timed = session['timedSession']
+        return {'assignment': self._convert_assignment(assignment), 'timed': timed}
+
     async def set_assignment_responses(
         self, subject_id: str, id: str, responses: list[dict[str, Any]]
     ):
@@ -218,7 +507,7 @@ class APClassroom:
         )
         if data is None or data.get('learnositySignedRequest') is None:
             raise BusinessError('Cannot get assignment (review) items')
-        signed_request = json.loads(data['learnositySignedRequest'])
+        signed_request = jsoncodec.loads(data['learnositySignedRequest'])
         return await Assignment.from_signed_request(signed_request, ensure_set=False)
 
     async def get_assignment_review(self, subject_id: str, id: str):
@@ -240,7 +529,7 @@ class APClassroom:
             'query assignment($a:String,$s:String){assignment(assignmentId:$a){resultsByItem(studentId:$s)}}',
             {'a': id, 's': str(self._auth.user_id)},
         )
-        signed_request = json.loads(data['resultsByItem'])
+        signed_request = jsoncodec.loads(data['resultsByItem'])
         report = await make_signed_request(
             signed_request, 'https://reports-va.learnosity.com/v2023.2.LTS/init'
         )
@@ -278,7 +567,7 @@ class APClassroom:
     async def get_scoring_raw(self, subject_id: str, id: str):
         gql = await self.get_scoring_gql(subject_id, id)
         return await Assignment.from_signed_request(
-            json.loads(gql['studentSessionReviewSignedRequest']), ensure_set=False
+            jsoncodec.loads(gql['studentSessionReviewSignedRequest']), ensure_set=False
         )
 
     async def get_scoring(self, subject_id: str, id: str):
@@ -294,13 +583,13 @@ class APClassroom:
 
     async def get_scoring_categories(self, subject_id: str, id: str):
         gql = await self.get_scoring_gql(subject_id, id)
-        return json.loads(gql['rubricCategoryReferencesByQuestion'])
+        return jsoncodec.loads(gql['rubricCategoryReferencesByQuestion'])
 
     @cached(lambda self, _, id: f'rubric.{id}.{self._auth.user_id}', 60 * 30)
     async def get_scoring_rubric_raw(self, subject_id: str, id: str):
         gql = await self.get_scoring_gql(subject_id, id)
         return await Assignment.from_signed_request(
-            json.loads(gql['scoringRubricSignedRequest'])
+            jsoncodec.loads(gql['scoringRubricSignedRequest'])
         )
 
     async def get_scoring_rubric(self, subject_id: str, id: str):
@@ -323,6 +612,11 @@ class APClassroom:
         return await assignment.set_responses(responses)
 
     async def submit_scoring(self, subject_id: str, id: str):
+        await prefetch(
+            cache_key(APClassroom.get_scoring_gql, self, subject_id, id),
+            cache_key(APClassroom.get_scoring_raw, self, subject_id, id),
+            cache_key(APClassroom.get_scoring_rubric_raw, self, subject_id, id),
+        )
         assignment = await self.get_scoring(subject_id, id)
         categories = await self.get_scoring_categories(subject_id, id)
         rubric = await self.get_scoring_rubric(subject_id, id)
@@ -363,7 +657,7 @@ class APClassroom:
             {
                 'a': id,
                 's': self._auth.user_id,
-                'c': json.dumps(scores, separators=(',', ':')),
+                'c': jsoncodec.dumps(scores),
             },
         )
         if data is None or not data.get('ok', False):
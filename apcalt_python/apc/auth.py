@@ -1,20 +1,121 @@
+import asyncio
+import hashlib
+import re
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import Any, TypedDict
+from typing import Any, AsyncIterator, NotRequired, TypedDict
 
-from aiohttp import ClientSession
+from quart import Quart, current_app
 from yarl import URL
 
+from .. import tracing
+from ..decorator import revalidate, single_flight
 from ..exceptions import BusinessError
 from ..log import get_logger as _logger
-from ..request import HEADERS, get_session
+from ..request import get_session, new_session
+from ..sessions import MemoryStore, register_codec_type
 from .api import APClassroom
 
+LOGIN_URL = 'https://account.collegeboard.org/login/login?appId=366&idp=ECL&DURL=https://myap.collegeboard.org/login'
+AUTHN_URL = 'https://prod.idp.collegeboard.org/api/v1/authn'
+COOKIE_URL = 'https://www.collegeboard.org'
+SUCRED_URL = 'https://sucred.catapult-prod.collegeboard.org/rel/temp-user-aws-creds'
+ACCOUNTS_URL = 'https://am-accounts-production.collegeboard.org/account/api/'
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    # logins talking to the login hosts at once; the rest wait in line. Capped
+    # at the concurrency of the login hosts in HTTP_HOST_LIMITS, past which
+    # logins would only queue again, unseen, in the host governor
+    'LOGIN_CONCURRENCY': 10,
+    'LOGIN_QUEUE_WARN': 2.0,
+    # seconds a login waits in line before it is turned away with a 503 and a
+    # Retry-After of the same length; None waits for as long as it takes
+    'LOGIN_QUEUE_TIMEOUT': 10.0,
+}
+
+_STATE_TOKEN = re.compile(r'"stateToken":"((?:[^"\\]|\\.)*)"')
+_HEX_ESCAPE = re.compile(r'\\x([0-9A-Fa-f]{2})')
+
+# credentials this close to expiry are still used, but renewed in the background
+REFRESH_MARGIN = 120
+
+# the latest credentials refreshed by this process, by cb_login, so that
+# every session of a user picks up a background refresh
+_LATEST = MemoryStore(max_entries=10000)
+
+# sessions only hold this key; the credentials are kept once per user in the
+# session store and shared by every session (and worker) of that user
+_CREDENTIALS_PREFIX = 'credentials.'
+
 
 class LoginData(TypedDict):
     cb_login: str
     cb_user_name: str
     aws_expire: datetime
     account: Any
+    # expiry times as timestamps, parsed once; missing in older sessions
+    aws_deadline: NotRequired[float]
+    account_deadline: NotRequired[float]
+
+
+def extract_state_token(page: str) -> str | None:
+    # the token sits in an inline script, with \xHH escapes
+    match = _STATE_TOKEN.search(page)
+    if match is None:
+        return None
+    return _HEX_ESCAPE.sub(lambda m: chr(int(m[1], 16)), match[1])
+
+
+_ADMISSION: asyncio.Semaphore | None = None
+_QUEUE_WARN = DEFAULT_CONFIG['LOGIN_QUEUE_WARN']
+_QUEUE_TIMEOUT = DEFAULT_CONFIG['LOGIN_QUEUE_TIMEOUT']
+
+
+@asynccontextmanager
+async def _admit() -> AsyncIterator[None]:
+    if _ADMISSION is None:
+        yield
+        return
+    start = time.monotonic()
+    with tracing.span('queue', 'login'):
+        try:
+            await asyncio.wait_for(_ADMISSION.acquire(), _QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            _logger().warning('Login turned away after %.2fs in line', _QUEUE_TIMEOUT)
+            raise BusinessError(
+                'Too many people are logging in, please try again shortly',
+                503,
+                retry_after=_QUEUE_TIMEOUT,
+            ) from None
+    waited = time.monotonic() - start
+    if waited > _QUEUE_WARN:
+        _logger().warning('Login waited %.2fs for admission', waited)
+    try:
+        yield
+    finally:
+        _ADMISSION.release()
+
+
+def init_login(app: Quart) -> None:
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.before_serving
+    async def _start_admission():
+        global _ADMISSION, _QUEUE_WARN, _QUEUE_TIMEOUT
+        concurrency = app.config['LOGIN_CONCURRENCY']
+        for url in (LOGIN_URL, AUTHN_URL):
+            limits = app.config.get('HTTP_HOST_LIMITS', {}).get(URL(url).host)
+            if limits:
+                concurrency = min(concurrency, limits['concurrency'])
+        _ADMISSION = asyncio.Semaphore(concurrency)
+        _QUEUE_WARN = app.config['LOGIN_QUEUE_WARN']
+        _QUEUE_TIMEOUT = app.config['LOGIN_QUEUE_TIMEOUT']
+
+
+def _deadline(expires: str) -> float:
+    return datetime.fromisoformat(expires).replace(tzinfo=timezone.utc).timestamp()
 
 
 class APCAuth:
@@ -27,12 +128,20 @@ class APCAuth:
             'cb_user_name': '',
             'aws_expire': datetime.now(timezone.utc),
             'account': None,
+            'aws_deadline': 0.0,
+            'account_deadline': 0.0,
         }
 
     def __init__(self):
         self.data = self._default_data()
         self.modified = False
 
+    @classmethod
+    def _from_data(cls, data: LoginData) -> 'APCAuth':
+        auth = cls()
+        auth.data = data
+        return auth
+
     @property
     def user_id(self):
         return self.data['account']['id']
@@ -40,25 +149,24 @@ class APCAuth:
     async def login(self, username: str, password: str):
         self.data.update(self._default_data())
         self.modified = True
-        async with ClientSession(headers=HEADERS) as sess:
-            async with sess.get(
-                'https://account.collegeboard.org/login/login?appId=366&idp=ECL&DURL=https://myap.collegeboard.org/login'
-            ) as r:
+        async with _admit():
+            await self._sign_in(username, password)
+        # the admission slot only covers the login hosts
+        await self.ensure_aws()
+
+    async def _sign_in(self, username: str, password: str):
+        async with new_session() as sess:
+            async with sess.get(LOGIN_URL) as r:
                 t = await r.text()
             if r.status == 403:
                 _logger().error('Login returned 403, is this IP address banned?: %s', t)
                 raise BusinessError('Cannot login to APC')
-            if '"stateToken":' not in t:
+            state_token = extract_state_token(t)
+            if state_token is None:
                 _logger().error('State token not found: %s', t)
-            start_idx = t.index('"stateToken":') + 14
-            end_idx = t.index('"', start_idx)
-            state_token = t[start_idx:end_idx]
-            while r'\x' in state_token:
-                idx = state_token.index(r'\x')
-                c = chr(int(state_token[idx + 2 : idx + 4], 16))
-                state_token = state_token[:idx] + c + state_token[idx + 4 :]
+                raise BusinessError('Failed to login to APC')
             async with sess.post(
-                'https://prod.idp.collegeboard.org/api/v1/authn',
+                AUTHN_URL,
                 json={
                     'username': username,
                     'password': password,
@@ -76,26 +184,52 @@ class APCAuth:
             next_link = authn['_links']['next']['href']
             async with sess.get(next_link) as r:
                 t = await r.text()
-            cookies = sess.cookie_jar.filter_cookies(URL('https://www.collegeboard.org'))
+            cookies = sess.cookie_jar.filter_cookies(URL(COOKIE_URL))
             if 'cb_login' not in cookies:
                 _logger().error('No cb_login cookie found: %s: %s', cookies, t)
             self.data['cb_login'] = cookies['cb_login'].value
-        await self.ensure_aws()
 
     async def logout(self):
         self.data.update(self._default_data())
         self.modified = True
 
-    async def ensure_aws(self):
-        if (
-            self.data['cb_user_name']
-            and self.data['aws_expire']
-            and self.data['aws_expire'] > datetime.now(timezone.utc)
-        ):
+    def _flight_key(self, kind: str) -> str:
+        digest = hashlib.sha1(self.data['cb_login'].encode()).hexdigest()[:16]
+        return f'auth.{kind}.{digest}'
+
+    def _adopt(self, kind: str) -> float:
+        # returns the deadline of the credentials of this kind now in self.data
+        data = self.data
+        if kind == 'aws':
+            deadline = data.get('aws_deadline')
+            if deadline is None and data['cb_user_name'] and data['aws_expire']:
+                deadline = data['aws_expire'].timestamp()
+        else:
+            deadline = data.get('account_deadline')
+            if deadline is None and data['account'] is not None:
+                deadline = _deadline(data['account']['expires'])
+        latest = _LATEST.get(self._flight_key(kind))
+        if latest is not None and latest[f'{kind}_deadline'] > (deadline or 0):
+            data.update(latest)
+            self.modified = True
+            deadline = latest[f'{kind}_deadline']
+        return deadline or 0
+
+    async def _ensure(self, kind: str, refresh: Any) -> None:
+        remaining = self._adopt(kind) - time.time()
+        if remaining > REFRESH_MARGIN:
+            return
+        key = self._flight_key(kind)
+        if remaining > 0:
+            revalidate(key, refresh)
             return
+        self.data.update(await single_flight(key, refresh))
+        self.modified = True
+
+    async def _refresh_aws(self) -> dict[str, Any]:
         session = get_session()
         async with session.get(
-            'https://sucred.catapult-prod.collegeboard.org/rel/temp-user-aws-creds',
+            SUCRED_URL,
             headers={'Authorization': 'CBLogin ' + self.data['cb_login']},
             params={
                 'cbEnv': 'pine',
@@ -112,34 +246,49 @@ class APCAuth:
         if r.status != 200:
             _logger().error('Error received from AWS refresh: %s', creds)
             raise BusinessError('Refresh AWS failed')
-        self.data['cb_user_name'] = creds['cbUserProfile']['sessionInfo'][
-            'identityKey'
-        ]['userName']
-        self.data['aws_expire'] = datetime.fromisoformat(
+        expire = datetime.fromisoformat(
             creds['catapult']['Credentials']['Expiration'][:-1]
         ).replace(tzinfo=timezone.utc)
-        self.modified = True
+        latest = {
+            'cb_user_name': creds['cbUserProfile']['sessionInfo']['identityKey'][
+                'userName'
+            ],
+            'aws_expire': expire,
+            'aws_deadline': expire.timestamp(),
+        }
+        self._remember('aws', latest)
+        return latest
 
-    async def ensure_account(self):
+    async def _refresh_account(self) -> dict[str, Any]:
         await self.ensure_aws()
-        if self.data['account'] is not None and datetime.fromisoformat(
-            self.data['account']['expires']
-        ).replace(tzinfo=timezone.utc) > datetime.now(timezone.utc):
-            return
         sess = get_session()
         async with sess.post(
-            'https://am-accounts-production.collegeboard.org/account/api/',
+            ACCOUNTS_URL,
             json={
                 'namespace': 'st',
                 'sessionId': self.data['cb_login'],
                 'username': self.data['cb_user_name'],
             },
+            idempotent=True,
         ) as r:
             if r.status == 400:
                 raise BusinessError('Failed to get APC token, please login again', 401)
             account = await r.json()
-        self.data['account'] = account
-        self.modified = True
+        latest = {'account': account, 'account_deadline': _deadline(account['expires'])}
+        self._remember('account', latest)
+        return latest
+
+    def _remember(self, kind: str, latest: dict[str, Any]) -> None:
+        expiry = latest[f'{kind}_deadline'] - time.time()
+        if expiry > 0:
+            _LATEST.set(self._flight_key(kind), latest, expiry)
+
+    async def ensure_aws(self):
+        await self._ensure('aws', self._refresh_aws)
+
+    async def ensure_account(self):
+        await self.ensure_aws()
+        await self._ensure('account', self._refresh_account)
 
     async def access_token(self):
         await self.ensure_account()
@@ -148,3 +297,38 @@ class APCAuth:
     @property
     def api(self):
         return APClassroom(self)
+
+
+def credentials_key(user_name: str) -> str:
+    digest = hashlib.sha1(user_name.encode()).hexdigest()
+    return _CREDENTIALS_PREFIX + digest
+
+
+async def load_auth(ref: Any) -> APCAuth | None:
+    if isinstance(ref, APCAuth):
+        # sessions from before credentials were shared carry their own copy;
+        # saving it moves the copy to the store and leaves a reference behind
+        ref.modified = True
+        return ref
+    if not isinstance(ref, str) or not ref.startswith(_CREDENTIALS_PREFIX):
+        return None
+    data = await current_app.session_interface.get(ref, current_app)
+    if data is None:
+        return None
+    # the memory store hands out the stored object itself
+    return APCAuth._from_data(dict(data))
+
+
+async def store_auth(auth: APCAuth) -> str | None:
+    if not auth.data['cb_user_name']:
+        return None
+    key = credentials_key(auth.data['cb_user_name'])
+    lifetime = int(current_app.permanent_session_lifetime.total_seconds())
+    await current_app.session_interface.set(key, auth.data, current_app, lifetime)
+    auth.modified = False
+    return key
+
+
+register_codec_type(
+    APCAuth, 'APCAuth', lambda auth: auth.data, APCAuth._from_data, nested=True
+)
@@ -1,19 +1,26 @@
-import pickle
 import re
 from datetime import timedelta
 from importlib import resources
-from typing import Any, cast
+from math import ceil
+from typing import Any
 
 import redis.asyncio
 from quart import Quart, Response, abort, current_app, g, request, send_file, session
-from quart.typing import ResponseReturnValue
+from quart.typing import ResponseReturnValue, ResponseTypes
+from quart.wrappers import Request
 from quart_cors import cors
 from werkzeug.security import safe_join
 
+from . import jsoncodec, tracing
+from .apc.auth import init_login, store_auth
+from .assets import init_static, static_response
+from .compress import init_compression
 from .decorator import allow_anonymous
 from .exceptions import BusinessError
-from .routes import ROUTES
+from .request import init_client
+from .routes import ROUTES, is_admin
 from .sessions import Session
+from .warmup import init_warmup
 
 __all__ = ['build_app']
 
@@ -28,9 +35,36 @@ class CustomQuart(Quart):
             rv = {'code': 200, 'data': rv}
         return await super().make_response(rv)
 
+    async def handle_request(self, request: Request) -> ResponseTypes:
+        # the trace covers opening and saving the session as well as the view
+        with tracing.trace() as trace:
+            response = await super().handle_request(request)
+        # spans name cache key families, upstream hosts and queue waits, so
+        # by default only requests carrying the admin token get the header
+        if self.config['TRACE_SERVER_TIMING'] or is_admin(self, request):
+            response.headers['Server-Timing'] = trace.server_timing(
+                self.config['TRACE_MAX_SPANS']
+            )
+        if self.config['TRACE_LOG']:
+            self.logger.info(
+                'trace %s',
+                jsoncodec.dumps(
+                    {
+                        'method': request.method,
+                        'path': request.path,
+                        'status': response.status_code,
+                        **trace.as_dict(),
+                    }
+                ),
+            )
+        return response
+
 
 @allow_anonymous
 async def _static_route(path: str):
+    response = static_response(path)
+    if response is not None:
+        return response
     safe = safe_join('static', path)
     if safe is None:
         abort(404)
@@ -50,6 +84,8 @@ async def _error_handler(error: BusinessError):
     data: dict[str, Any] = {'code': error.code}
     if error.msg is not None:
         data['msg'] = error.msg
+    if error.retry_after is not None:
+        return data, error.code, {'Retry-After': str(ceil(error.retry_after))}
     return data, error.code
 
 
@@ -62,15 +98,18 @@ async def _before_request():
     view_func = current_app.view_functions.get(endpoint)
     if view_func is None:
         return
+    # the credentials themselves are only loaded by views that use them
     if not getattr(view_func, '__allow_anonymous__', False) and 'auth' not in session:
         raise BusinessError('Please login first', 401)
-    if 'auth' in session:
-        g.auth = session['auth']
 
 
 async def _after_request(response):
     if 'auth' in g and g.auth.modified:
-        session['auth'] = g.auth
+        ref = await store_auth(g.auth)
+        if ref is None:
+            session.pop('auth', None)
+        elif session.get('auth') != ref:
+            session['auth'] = ref
     return response
 
 
@@ -92,9 +131,17 @@ def build_app(
             app.config['SESSION_URI'], encoding='utf-8', decode_responses=False
         )
     app.config.setdefault('PERMANENT_SESSION_LIFETIME', timedelta(days=30))
+    app.config.setdefault('TRACE_SERVER_TIMING', False)
+    app.config.setdefault('TRACE_MAX_SPANS', 30)
+    app.config.setdefault('TRACE_LOG', False)
+    app.config.setdefault('DASHBOARD_CONCURRENCY', 4)
     app = cors(app, allow_credentials=True, allow_origin=[re.compile(r'.*')])
     Session(app)
-    cast(Any, app.session_interface).serializer = pickle
+    init_client(app)
+    init_warmup(app)
+    init_login(app)
+    init_compression(app)
+    init_static(app)
     app.add_url_rule('/<path:path>', view_func=_static_route)
     app.add_url_rule('/', view_func=_home_route)
     for route in ROUTES:
@@ -0,0 +1,113 @@
+import asyncio
+import mimetypes
+import re
+from importlib import resources
+from importlib.resources.abc import Traversable
+from typing import Any
+
+from quart import Quart, Response, abort, request
+
+from .compress import ENCODINGS, compress, etag
+
+__all__ = ['StaticAsset', 'build_index', 'init_static', 'static_response']
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    # index the bundle in memory at startup; turn off while rebuilding the
+    # frontend so that changes are picked up without a restart
+    'STATIC_CACHE': True,
+    'STATIC_GZIP_LEVEL': 9,
+    'STATIC_BROTLI_QUALITY': 11,
+}
+
+# build output names like assets/index-4f3a9c1b.js change with their content
+_HASHED = re.compile(r'^assets/.+[-.][0-9A-Za-z_]{8,}\.[0-9a-z]+$')
+_COMPRESSIBLE = re.compile(
+    r'^text/|^application/(?:javascript|json|xml|wasm|manifest\+json)$|\+xml$'
+)
+_MIN_SIZE = 256
+
+
+class StaticAsset:
+    __slots__ = ('mimetype', 'etag', 'immutable', 'variants')
+
+    def __init__(self, path: str, data: bytes, levels: dict[str, int]):
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.etag = etag(data)
+        self.immutable = _HASHED.match(path) is not None
+        # identity first; encoded variants only where they are smaller
+        self.variants: dict[str | None, bytes] = {None: data}
+        if len(data) >= _MIN_SIZE and _COMPRESSIBLE.search(self.mimetype):
+            for encoding in ENCODINGS:
+                encoded = compress(data, encoding, levels[encoding])
+                if len(encoded) < len(data):
+                    self.variants[encoding] = encoded
+
+    @property
+    def cache_control(self) -> str:
+        if self.immutable:
+            return 'public, max-age=31536000, immutable'
+        return 'no-cache'
+
+
+def build_index(root: Traversable, levels: dict[str, int]) -> dict[str, StaticAsset]:
+    index = {}
+    pending = [('', root)]
+    while pending:
+        prefix, directory = pending.pop()
+        if not directory.is_dir():
+            continue
+        for entry in directory.iterdir():
+            path = prefix + entry.name
+            if entry.is_dir():
+                pending.append((path + '/', entry))
+            else:
+                index[path] = StaticAsset(path, entry.read_bytes(), levels)
+    return index
+
+
+INDEX: dict[str, StaticAsset] | None = None
+
+
+def static_response(path: str) -> Response | None:
+    # None when the bundle isn't indexed, so that the caller reads the file
+    if INDEX is None:
+        return None
+    asset = INDEX.get(path)
+    if asset is None:
+        abort(404)
+    encoding = None
+    if len(asset.variants) > 1:
+        encoding = request.accept_encodings.best_match(
+            [name for name in asset.variants if name is not None]
+        )
+    tag = asset.etag if encoding is None else f'{asset.etag}-{encoding}'
+    if request.if_none_match.contains_weak(tag):
+        response = Response('', status=304)
+    else:
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = asset.cache_control
+    if len(asset.variants) > 1:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_static(app: Quart) -> None:
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.before_serving
+    async def _index_static():
+        global INDEX
+        if not app.config['STATIC_CACHE']:
+            INDEX = None
+            return
+        levels = {
+            'br': app.config['STATIC_BROTLI_QUALITY'],
+            'gzip': app.config['STATIC_GZIP_LEVEL'],
+        }
+        root = resources.files(__package__).joinpath('static')
+        INDEX = await asyncio.to_thread(build_index, root, levels)
+        app.logger.info('Indexed %d static files', len(INDEX))
@@ -0,0 +1,83 @@
+import asyncio
+import gzip
+import hashlib
+from typing import Any
+
+from quart import Quart, Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ['ENCODINGS', 'compress', 'etag', 'init_compression', 'negotiate']
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    'COMPRESS_MIN_SIZE': 1024,
+    'COMPRESS_GZIP_LEVEL': 6,
+    'COMPRESS_BROTLI_QUALITY': 5,
+}
+
+# preferred first when the client accepts several equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# bodies at least this large are compressed off the event loop
+_THREAD_MIN_SIZE = 256 * 1024
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def negotiate(accept_encodings: Any) -> str | None:
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def etag(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def init_compression(app: Quart) -> None:
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    levels = {
+        'br': app.config['COMPRESS_BROTLI_QUALITY'],
+        'gzip': app.config['COMPRESS_GZIP_LEVEL'],
+    }
+    min_size = app.config['COMPRESS_MIN_SIZE']
+
+    @app.after_request
+    async def _compress_json(response: Response) -> Response:
+        if (
+            response.mimetype != 'application/json'
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or 'ETag' in response.headers
+        ):
+            return response
+        data = await response.get_data()
+        encoding = None
+        if len(data) >= min_size:
+            encoding = negotiate(request.accept_encodings)
+        # strong validators differ between content codings of the same body
+        tag = etag(data) if encoding is None else f'{etag(data)}-{encoding}'
+        response.vary.add('Accept-Encoding')
+        # only safe methods may be answered with 304 Not Modified
+        safe = request.method in ('GET', 'HEAD')
+        if safe and request.if_none_match.contains_weak(tag):
+            not_modified = app.response_class('', status=304)
+            not_modified.set_etag(tag)
+            not_modified.headers['Vary'] = response.headers['Vary']
+            return not_modified
+        response.set_etag(tag)
+        if encoding is None:
+            return response
+        if len(data) >= _THREAD_MIN_SIZE:
+            data = await asyncio.to_thread(compress, data, encoding, levels[encoding])
+        else:
+            data = compress(data, encoding, levels[encoding])
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        return response
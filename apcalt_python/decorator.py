@@ -1,39 +1,158 @@
+import asyncio
+import time
 from functools import wraps
-from typing import Awaitable, Callable, ParamSpec, TypeVar, cast
+from typing import Any, Awaitable, Callable, ParamSpec, TypeVar, cast
 
-from quart import current_app
+from quart import current_app, g
 from quart.typing import RouteCallable
 
+from .metrics import CACHE_METRICS
 from .sessions import BaseSessionInterface
 
-__all__ = ['allow_anonymous', 'cached']
+__all__ = [
+    'allow_anonymous',
+    'cached',
+    'cache_key',
+    'prefetch',
+    'prime',
+    'revalidate',
+    'shared_key',
+    'single_flight',
+]
 
 T = TypeVar('T')
 P = ParamSpec('P')
 CallableT = TypeVar('CallableT', bound=Callable[..., Awaitable])
 RouteCallableT = TypeVar('RouteCallableT', bound=RouteCallable)
 
+_inflight: dict[str, 'asyncio.Task[Any]'] = {}
+
 
 def allow_anonymous(func: RouteCallableT) -> RouteCallableT:
     func.__allow_anonymous__ = True
     return func
 
 
+def _retrieve_exception(task: 'asyncio.Task[Any]') -> None:
+    # every waiter may have been cancelled; don't warn about an unretrieved error
+    if not task.cancelled():
+        task.exception()
+
+
+def _flight(key: str, factory: Callable[[], Awaitable[T]]) -> 'asyncio.Task[T]':
+    task = _inflight.get(key)
+    if task is None:
+
+        async def run():
+            try:
+                return await factory()
+            finally:
+                _inflight.pop(key, None)
+
+        task = asyncio.ensure_future(run())
+        task.add_done_callback(_retrieve_exception)
+        _inflight[key] = task
+    return task
+
+
+async def single_flight(key: str, factory: Callable[[], Awaitable[T]]) -> T:
+    # shield so that a cancelled caller doesn't abort the work others wait on
+    return await asyncio.shield(_flight(key, factory))
+
+
+def revalidate(key: str, factory: Callable[[], Awaitable[Any]]) -> None:
+    if key in _inflight:
+        return
+    logger = current_app.logger
+
+    def log_failure(task: 'asyncio.Task[Any]') -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                'Background refresh of %s failed', key, exc_info=task.exception()
+            )
+
+    _flight(key, factory).add_done_callback(log_failure)
+
+
+def shared_key(*parts: Any) -> str:
+    # keys in this namespace are served to every user, so values cached under
+    # them must not contain anything specific to the user who fetched them
+    return '.'.join(['shared', *map(str, parts)])
+
+
 def cached(
-    key_func: Callable[..., str], expiry: int | None = None
+    key_func: Callable[..., str],
+    expiry: int | None = None,
+    stale_after: int | None = None,
+    scrub: Callable[[Any], Any] | None = None,
 ) -> Callable[[CallableT], CallableT]:
+    # With stale_after, entries are stored as (fetched_at, value). Entries older
+    # than stale_after are still served but refreshed in the background; only
+    # a miss, i.e. an entry past its hard expiry, waits for the upstream.
+    # scrub is applied to fresh results before they are stored or returned.
     def decorator(func: CallableT) -> CallableT:
+        async def store(cache_key: str, result: Any) -> Any:
+            if scrub is not None:
+                result = scrub(result)
+            stored = result if stale_after is None else (time.time(), result)
+            cache = cast(BaseSessionInterface, current_app.session_interface)
+            await cache.set(cache_key, stored, current_app, expiry)
+            return result
+
         @wraps(func)
         async def inner(self, *args, **kwargs):
             cache_key = key_func(self, *args, **kwargs)
             cache = cast(BaseSessionInterface, current_app.session_interface)
-            cached = await cache.get(cache_key, current_app)
-            if cached is not None:
+            prefetched = g.get('_cache_prefetch')
+            if prefetched and cache_key in prefetched:
+                cached = prefetched[cache_key]
+            else:
+                cached = await cache.get(cache_key, current_app)
+
+            async def load():
+                return await store(cache_key, await func(self, *args, **kwargs))
+
+            if cached is None:
+                CACHE_METRICS.miss(cache_key, coalesced=cache_key in _inflight)
+                return await single_flight(cache_key, load)
+            if stale_after is None:
+                CACHE_METRICS.hit(cache_key)
                 return cached
-            result = await func(self, *args, **kwargs)
-            await cache.set(cache_key, result, current_app, expiry)
-            return result
+            fetched_at, value = cached
+            stale = time.time() - fetched_at > stale_after
+            CACHE_METRICS.hit(cache_key, stale=stale)
+            if stale:
+                revalidate(cache_key, load)
+            return value
 
+        inner.__cache_key__ = key_func
+        inner.__cache_store__ = store
         return cast(CallableT, inner)
 
     return decorator
+
+
+def cache_key(func: Callable[..., Awaitable], *args: Any, **kwargs: Any) -> str:
+    return func.__cache_key__(*args, **kwargs)
+
+
+async def prime(func: Callable[..., Awaitable[T]], value: T, *args: Any) -> T:
+    # store a value fetched some other way (e.g. in a batched request) as the
+    # result of func(*args)
+    return await func.__cache_store__(func.__cache_key__(*args), value)
+
+
+async def prefetch(*keys: str) -> list[str]:
+    # load several cache entries in one backend round trip; `cached` functions
+    # called later in the same request are served from these values. Returns
+    # the keys that were not cached.
+    cache = cast(BaseSessionInterface, current_app.session_interface)
+    values = await cache.get_many(list(keys), current_app)
+    prefetched = g.setdefault('_cache_prefetch', {})
+    missing = []
+    for key, value in zip(keys, values):
+        if value is None:
+            missing.append(key)
+        else:
+            prefetched[key] = value
+    return missing
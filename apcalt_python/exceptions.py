@@ -1,7 +1,14 @@
 class BusinessError(RuntimeError):
-    __slots__ = 'msg', 'code'
+    __slots__ = 'msg', 'code', 'retry_after'
 
-    def __init__(self, msg: str | None = None, code: int = 500, *args):
+    def __init__(
+        self,
+        msg: str | None = None,
+        code: int = 500,
+        *args,
+        retry_after: float | None = None,
+    ):
         self.msg = msg
         self.code = code
+        self.retry_after = retry_after
         super().__init__(*args)
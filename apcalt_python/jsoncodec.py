@@ -0,0 +1,79 @@
+import json
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['BACKEND', 'dumpb', 'dumps', 'loads']
+
+BACKEND = 'json' if orjson is None else 'orjson'
+
+
+def _std_dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> str:
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=default)
+
+
+def _check_keys(value: Any) -> Any:
+    # the stdlib turns non-str keys into strings, which wouldn't load back
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError(f'Cannot encode key {key!r}')
+            _check_keys(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _check_keys(item)
+    return value
+
+
+def _checked(default: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    return lambda value: _check_keys(default(value))
+
+
+# With strict=True, values that would not load back as they were (non-str
+# keys, integers over 64 bits) raise TypeError instead of being coerced.
+
+if orjson is None:
+
+    def loads(data: str | bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> str:
+        return _std_dumps(obj, default)
+
+    def dumpb(
+        obj: Any, default: Callable[[Any], Any] | None = None, strict: bool = False
+    ) -> bytes:
+        if strict:
+            _check_keys(obj)
+            if default is not None:
+                default = _checked(default)
+        return _std_dumps(obj, default).encode()
+
+else:
+    # orjson output is already compact and leaves non-ASCII characters as-is,
+    # matching separators=(',', ':') and ensure_ascii=False. Anything it
+    # refuses (non-str keys, integers over 64 bits, NaN) goes through the
+    # stdlib instead.
+    _OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def loads(data: str | bytes) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+    def dumpb(
+        obj: Any, default: Callable[[Any], Any] | None = None, strict: bool = False
+    ) -> bytes:
+        try:
+            return orjson.dumps(obj, default=default, option=_OPTIONS)
+        except orjson.JSONEncodeError:
+            if strict:
+                raise
+            return _std_dumps(obj, default).encode()
+
+    def dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> str:
+        return dumpb(obj, default).decode()
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import time
 from copy import deepcopy
 from typing import Any, Self
@@ -8,15 +7,13 @@ from quart import current_app
 
 from ..decorator import cached
 from ..exceptions import BusinessError
+from ..jsoncodec import dumps as _dumps
 from ..request import USER_AGENT
 from ..request import get_session as _sess
+from ..sessions import register_codec_type
 from .request import make_signed_request
 
 
-def _dumps(data):
-    return json.dumps(data, separators=(',', ':'))
-
-
 class Assignment:
     __slots__ = 'data', '_cache'
 
@@ -49,6 +46,7 @@ class Assignment:
                 'security': _dumps(self._security),
                 'usrequest': '{"metricsContext":["itemsapi","assessapi"]}',
             },
+            idempotent=True,
         ) as r:
             data = await r.json()
         return data['data']
@@ -79,6 +77,7 @@ class Assignment:
                 'security': security_s,
                 'usrequest': _dumps(usrequest),
             },
+            idempotent=True,
         ) as r:
             data = await r.json()
         self._cache['responses'] = (time.time() + 5, data['data'])
@@ -241,7 +240,10 @@ class Assignment:
         }
 
     async def _ensure_set_responses(self):
-        print('&&&', self.data)
+        current_app.logger.debug(
+            'Setting responses for session %s',
+            self.data['data']['apiActivity']['questionsApiActivity']['session_id'],
+        )
         sess = _sess()
         auth_data = await self.get_question_auth()
         cid = auth_data['id']
@@ -265,6 +267,7 @@ class Assignment:
                 'security': security_s,
                 'usrequest': _dumps(usrequest),
             },
+            idempotent=True,
         ) as r:
             data = await r.json()
         new_ids = [
@@ -313,3 +316,8 @@ class Assignment:
         if ensure_set:
             await assignment._ensure_set_responses()
         return assignment
+
+
+register_codec_type(
+    Assignment, 'Assignment', lambda assignment: assignment.data, Assignment
+)
@@ -1,21 +1,16 @@
-import json
 from typing import Any
 
+from ..jsoncodec import dumps as _dumps
+from ..log import get_logger as _logger
 from ..request import get_session as _sess
 
 __all__ = ['make_signed_request']
 
 
-def _dumps(data):
-    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
-
-
 async def make_signed_request(signed_request: dict[str, Any], url: str):
     security = _dumps(signed_request['security'])
     request = _dumps(signed_request['request'])
-    print('warning signed request', signed_request)
-    print('error', security)
-    print('error', request)
+    _logger().debug('Signed request to %s: %s', url, signed_request)
     sess = _sess()
     async with sess.post(
         url,
@@ -24,7 +19,8 @@ async def make_signed_request(signed_request: dict[str, Any], url: str):
             'Origin': 'https://apclassroom.collegeboard.org',
             'Referer': 'https://apclassroom.collegeboard.org/',
         },
+        idempotent=True,
     ) as r:
         data = await r.json()
-        print('warning signed result', data)
+        _logger().debug('Signed request result: %s', data)
     return data
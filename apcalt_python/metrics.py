@@ -0,0 +1,146 @@
+import bisect
+import math
+from typing import Any
+
+__all__ = ['CACHE_METRICS', 'CacheMetrics', 'Histogram', 'key_prefix']
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> dict[str, Any]:
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip((*self.bounds, math.inf), self.counts):
+            cumulative += count
+            buckets['+Inf' if bound == math.inf else str(bound)] = cumulative
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else 0,
+            'buckets': buckets,
+        }
+
+
+class PrefixStats:
+    __slots__ = (
+        'hits',
+        'stale_hits',
+        'misses',
+        'coalesced',
+        'l1_hits',
+        'evictions',
+        'get_latency',
+        'set_latency',
+        'read_size',
+        'write_size',
+    )
+
+    def __init__(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.l1_hits = 0
+        self.evictions = 0
+        self.get_latency = Histogram(LATENCY_BUCKETS)
+        self.set_latency = Histogram(LATENCY_BUCKETS)
+        self.read_size = Histogram(SIZE_BUCKETS)
+        self.write_size = Histogram(SIZE_BUCKETS)
+
+    def snapshot(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'coalesced': self.coalesced,
+            'l1_hits': self.l1_hits,
+            'evictions': self.evictions,
+            'get_latency': self.get_latency.snapshot(),
+            'set_latency': self.set_latency.snapshot(),
+            'read_bytes': self.read_size.snapshot(),
+            'write_bytes': self.write_size.snapshot(),
+        }
+
+
+def key_prefix(key: str | None) -> str:
+    # 'assignment.1.2' -> 'assignment', 'shared.outline.3' -> 'shared.outline',
+    # 'session:abc' -> 'session'; None is used for entries of unknown origin
+    if key is None:
+        return '*'
+    parts = key.split('.', 2)
+    prefix = '.'.join(parts[:2]) if parts[0] == 'shared' else parts[0]
+    return prefix.split(':', 1)[0]
+
+
+class CacheMetrics:
+    def __init__(self):
+        self._prefixes: dict[str, PrefixStats] = {}
+
+    def __getitem__(self, key: str | None) -> PrefixStats:
+        prefix = key_prefix(key)
+        stats = self._prefixes.get(prefix)
+        if stats is None:
+            stats = self._prefixes[prefix] = PrefixStats()
+        return stats
+
+    def hit(self, key: str, stale: bool = False) -> None:
+        stats = self[key]
+        stats.hits += 1
+        if stale:
+            stats.stale_hits += 1
+
+    def miss(self, key: str, coalesced: bool = False) -> None:
+        stats = self[key]
+        stats.misses += 1
+        if coalesced:
+            stats.coalesced += 1
+
+    def l1_hit(self, key: str) -> None:
+        self[key].l1_hits += 1
+
+    def eviction(self, key: str | None, count: int = 1) -> None:
+        self[key].evictions += count
+
+    def get_latency(self, key: str, seconds: float) -> None:
+        self[key].get_latency.observe(seconds)
+
+    def set_latency(self, key: str, seconds: float) -> None:
+        self[key].set_latency.observe(seconds)
+
+    def read(self, key: str, size: int) -> None:
+        self[key].read_size.observe(size)
+
+    def write(self, key: str, size: int) -> None:
+        self[key].write_size.observe(size)
+
+    def reset(self) -> None:
+        self._prefixes.clear()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            prefix: stats.snapshot() for prefix, stats in sorted(self._prefixes.items())
+        }
+
+
+CACHE_METRICS = CacheMetrics()
@@ -0,0 +1,279 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+from http.cookies import SimpleCookie
+from typing import Any
+
+from aiohttp import ClientConnectionError, ClientResponse
+from aiohttp.abc import AbstractCookieJar
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from . import jsoncodec
+
+__all__ = ['MODES', 'FixtureNotFound', 'FixtureStore', 'ReplayResponse', 'scrub']
+
+MODES = ('live', 'record', 'replay')
+REDACTED = 'REDACTED'
+
+# string values under matching keys are replaced before anything is written
+_SECRET_KEY = re.compile(
+    r'password|secret|token|signature|accesskey|authorization|^sessionid$', re.I
+)
+_SECRET_TEXT = re.compile(
+    r'("[A-Za-z_]*(?:password|secret|token|signature)[A-Za-z_]*"\s*:\s*")'
+    r'(?:[^"\\]|\\.)*"',
+    re.I,
+)
+_SECRET_QUERY = re.compile(
+    r'((?:[?&]|&amp;)[A-Za-z_]*(?:password|secret|token|signature)[A-Za-z_]*=)'
+    r'[^&#"\'\s<>]*',
+    re.I,
+)
+# left out of the fixture key so that re-signed requests still match
+_VOLATILE_KEYS = frozenset({'timestamp', 'time'})
+_KEPT_HEADERS = ('Content-Type', 'Location')
+
+
+class FixtureNotFound(ClientConnectionError):
+    pass
+
+
+def _scrub_url(url: str) -> str:
+    # one-time tokens travel in query strings, e.g. Okta's sessionToken
+    parsed = URL(url)
+    if not parsed.query:
+        return url
+    query = [
+        (key, REDACTED if _SECRET_KEY.search(key) else value)
+        for key, value in parsed.query.items()
+    ]
+    return str(parsed.with_query(query))
+
+
+def _walk(value: Any, canonical: bool) -> Any:
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if canonical and key in _VOLATILE_KEYS:
+                continue
+            if isinstance(item, str) and _SECRET_KEY.search(str(key)):
+                result[key] = REDACTED
+            else:
+                result[key] = _walk(item, canonical)
+        return result
+    if isinstance(value, (list, tuple)):
+        return [_walk(item, canonical) for item in value]
+    if isinstance(value, bytes):
+        value = value.decode(errors='replace')
+    if isinstance(value, str) and value.startswith(('http://', 'https://')):
+        return _scrub_url(value)
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        # GraphQL and Learnosity nest JSON documents inside string fields
+        try:
+            parsed = jsoncodec.loads(value)
+        except ValueError:
+            return value
+        parsed = _walk(parsed, canonical)
+        return parsed if canonical else jsoncodec.dumps(parsed)
+    return value
+
+
+def scrub(value: Any) -> Any:
+    return _walk(value, False)
+
+
+def _scrub_text(text: str) -> str:
+    text = _SECRET_TEXT.sub(rf'\1{REDACTED}"', text)
+    return _SECRET_QUERY.sub(rf'\1{REDACTED}', text)
+
+
+def _scrub_cookie(header: str) -> str:
+    cookie = SimpleCookie()
+    cookie.load(header)
+    for morsel in cookie.values():
+        morsel.set(morsel.key, REDACTED, REDACTED)
+    return cookie.output(header='').strip()
+
+
+def _digest(value: Any) -> str:
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def fixture_key(method: str, url: str, kwargs: dict[str, Any]) -> tuple[str, Any]:
+    full = URL(url)
+    if kwargs.get('params'):
+        full = full.update_query(kwargs['params'])
+    full = full.with_query(sorted(full.query.items()))
+    body = kwargs.get('json', kwargs.get('data'))
+    return f'{method} {_scrub_url(str(full))}', _walk(body, True)
+
+
+class ReplayResponse:
+    def __init__(
+        self,
+        method: str,
+        url: str,
+        status: int,
+        reason: str,
+        headers: list[tuple[str, str]],
+        body: bytes,
+    ):
+        self.method = method
+        self.url = URL(url)
+        self.status = status
+        self.reason = reason
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.history = ()
+        self.content_length = len(body)
+        self._body = body
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    @property
+    def content_type(self) -> str:
+        content_type = self.headers.get('Content-Type', 'application/octet-stream')
+        return content_type.split(';', 1)[0].strip()
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding: str | None = None, errors: str = 'strict') -> str:
+        return self._body.decode(encoding or 'utf-8', errors)
+
+    async def json(self, *, loads: Any = jsoncodec.loads, **kwargs: Any) -> Any:
+        if not self._body.strip():
+            return None
+        return loads(self._body.decode(kwargs.get('encoding') or 'utf-8'))
+
+    def release(self) -> None:
+        pass
+
+
+class FixtureStore:
+    # Each exchange is stored as <root>/<host>/<sha1 of method, url and body>.json
+    # with a small route-<sha1 of method and url>.json alias pointing at the
+    # latest recording, used when no request body matches exactly.
+
+    def __init__(self, root: str, mode: str, latency: float | None = 0.0):
+        if mode not in MODES:
+            raise ValueError(f'Unknown upstream mode {mode!r}')
+        self.root = root
+        self.mode = mode
+        self.latency = latency
+        self._fixtures: dict[str, dict[str, Any]] = {}
+
+    def _path(self, url: str, name: str) -> str:
+        return os.path.join(self.root, URL(url).host or '_', name + '.json')
+
+    @staticmethod
+    def _write(path: str, data: dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(jsoncodec.dumpb(data))
+        os.replace(path + '.tmp', path)
+
+    def _read(self, path: str) -> dict[str, Any] | None:
+        fixture = self._fixtures.get(path)
+        if fixture is None:
+            try:
+                with open(path, 'rb') as f:
+                    fixture = self._fixtures[path] = jsoncodec.loads(f.read())
+            except FileNotFoundError:
+                return None
+        return fixture
+
+    def _lookup(self, url: str, digest: str, route_digest: str) -> Any:
+        fixture = self._read(self._path(url, digest))
+        if fixture is None:
+            alias = self._read(self._path(url, 'route-' + route_digest))
+            if alias is not None:
+                fixture = self._read(self._path(url, alias['fixture']))
+        return fixture
+
+    async def record(
+        self,
+        method: str,
+        url: str,
+        kwargs: dict[str, Any],
+        response: ClientResponse,
+        elapsed: float,
+    ) -> None:
+        route, body = fixture_key(method, url, kwargs)
+        digest = _digest([route, body])
+        raw = await response.read()
+        try:
+            text = raw.decode(response.get_encoding())
+        except (UnicodeDecodeError, RuntimeError, LookupError):
+            encoded, binary = base64.b64encode(raw).decode(), True
+        else:
+            encoded, binary = _scrub_text(text), False
+            if response.content_type == 'application/json':
+                try:
+                    encoded = jsoncodec.dumps(scrub(jsoncodec.loads(text)))
+                except ValueError:
+                    pass
+        cookies = [
+            [_scrub_url(str(r.url)), _scrub_cookie(header)]
+            for r in (*response.history, response)
+            for header in r.headers.getall('Set-Cookie', ())
+        ]
+        fixture = {
+            'route': route,
+            'request': scrub(kwargs.get('json', kwargs.get('data'))),
+            'elapsed': elapsed,
+            'response': {
+                'url': _scrub_url(str(response.url)),
+                'status': response.status,
+                'reason': response.reason,
+                'headers': [
+                    [name, response.headers[name]]
+                    for name in _KEPT_HEADERS
+                    if name in response.headers
+                ],
+                'cookies': cookies,
+                'body': encoded,
+                'binary': binary,
+            },
+        }
+
+        def write():
+            self._write(self._path(url, digest), fixture)
+            self._write(self._path(url, 'route-' + _digest(route)), {'fixture': digest})
+
+        await asyncio.to_thread(write)
+
+    async def replay(
+        self,
+        cookie_jar: AbstractCookieJar,
+        method: str,
+        url: str,
+        kwargs: dict[str, Any],
+    ) -> ReplayResponse:
+        route, body = fixture_key(method, url, kwargs)
+        fixture = await asyncio.to_thread(
+            self._lookup, url, _digest([route, body]), _digest(route)
+        )
+        if fixture is None:
+            raise FixtureNotFound(f'No upstream fixture for {route}')
+        latency = fixture['elapsed'] if self.latency is None else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        response = fixture['response']
+        for cookie_url, header in response['cookies']:
+            cookie_jar.update_cookies(SimpleCookie(header), URL(cookie_url))
+        body = response['body']
+        return ReplayResponse(
+            method,
+            response['url'],
+            response['status'],
+            response['reason'],
+            response['headers'],
+            base64.b64decode(body) if response['binary'] else body.encode(),
+        )
@@ -1,16 +1,502 @@
-from aiohttp import ClientSession
+import asyncio
+import os
+import random
+import time
+from typing import Any
 
-__all__ = ['get_session']
+from aiohttp import (
+    ClientConnectionError,
+    ClientResponse,
+    ClientSession,
+    ClientTimeout,
+    CookieJar,
+    TCPConnector,
+)
+from quart import Quart
+from yarl import URL
+
+from . import jsoncodec, tracing
+from .exceptions import BusinessError
+from .log import get_logger as _logger
+from .metrics import LATENCY_BUCKETS, Histogram
+from .replay import FixtureStore
+
+__all__ = [
+    'CircuitBreaker',
+    'HTTPClient',
+    'HostGovernor',
+    'TokenBucket',
+    'upstream_status',
+    'get_session',
+    'init_client',
+    'new_session',
+]
 
 USER_AGENT = (
     'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/116.0'
 )
 HEADERS = {'User-Agent': USER_AGENT}
 
-SESSION: ClientSession = None  # type: ignore
+DEFAULT_CONFIG: dict[str, Any] = {
+    'HTTP_LIMIT': 100,
+    'HTTP_LIMIT_PER_HOST': 20,
+    'HTTP_KEEPALIVE_TIMEOUT': 60,
+    'HTTP_DNS_TTL': 300,
+    'HTTP_CONNECT_TIMEOUT': 10,
+    'HTTP_READ_TIMEOUT': 30,
+    'HTTP_TOTAL_TIMEOUT': 60,
+    'HTTP_RETRY_ATTEMPTS': 3,
+    'HTTP_RETRY_BACKOFF': 0.2,
+    'HTTP_RETRY_MAX_BACKOFF': 2.0,
+    'HTTP_BREAKER_THRESHOLD': 5,
+    'HTTP_BREAKER_RESET': 30,
+    # rate in requests/second, burst in requests, concurrency in requests in
+    # flight (capped at HTTP_LIMIT_PER_HOST); hosts not listed here are not
+    # shaped. The login hosts (account.collegeboard.org and
+    # prod.idp.collegeboard.org) are left out so that a class logging in at
+    # once isn't held to a few logins a second; LOGIN_CONCURRENCY bounds them
+    # instead. A login makes two requests to the account host and one to the
+    # idp host, so e.g. {'rate': 10, 'burst': 20, 'concurrency': 10} on both
+    # allows about 5 logins/s.
+    'HTTP_HOST_LIMITS': {
+        'apc-api-production.collegeboard.org': {
+            'rate': 50,
+            'burst': 100,
+            'concurrency': 20,
+        },
+        'questions-va.learnosity.com': {'rate': 30, 'burst': 60, 'concurrency': 20},
+        'items-va.learnosity.com': {'rate': 20, 'burst': 40, 'concurrency': 20},
+        'reports-va.learnosity.com': {'rate': 10, 'burst': 20, 'concurrency': 10},
+    },
+    'HTTP_QUEUE_WARN': 1.0,
+    # 'record' saves scrubbed exchanges under UPSTREAM_FIXTURES, 'replay'
+    # serves them instead of contacting the hosts; a latency of None replays
+    # the recorded response times
+    'UPSTREAM_MODE': 'live',
+    'UPSTREAM_FIXTURES': os.path.join(os.getcwd(), 'upstream_fixtures'),
+    'UPSTREAM_REPLAY_LATENCY': 0.0,
+}
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitBreaker:
+    __slots__ = ('host', 'failures', 'opened_at', 'probing')
+
+    def __init__(self, host: str):
+        self.host = host
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= _CONFIG['HTTP_BREAKER_RESET']:
+            return 'half-open'
+        return 'open'
+
+    def before_request(self) -> None:
+        state = self.state
+        # while half-open a single probe request decides whether to close again
+        if state == 'open' or state == 'half-open' and self.probing:
+            raise BusinessError('%s is unavailable, try again later' % self.host, 503)
+        if state == 'half-open':
+            self.probing = True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or (
+            self.failures >= _CONFIG['HTTP_BREAKER_THRESHOLD']
+        ):
+            self.opened_at = time.monotonic()
+
+    def status(self) -> dict[str, Any]:
+        retry_in = None
+        if self.opened_at is not None:
+            retry_in = max(
+                0, self.opened_at + _CONFIG['HTTP_BREAKER_RESET'] - time.monotonic()
+            )
+        return {'state': self.state, 'failures': self.failures, 'retry_in': retry_in}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', '_lock')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        # the lock hands out tokens in arrival order, so callers queue fairly
+        # instead of racing for each refill
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class HostGovernor:
+    __slots__ = ('host', 'bucket', 'semaphore', 'queued', 'in_flight', 'wait')
+
+    def __init__(self, host: str, rate: float, burst: float, concurrency: int):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queued = 0
+        self.in_flight = 0
+        self.wait = Histogram(LATENCY_BUCKETS)
+
+    async def enter(self) -> float:
+        start = time.monotonic()
+        self.queued += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        waited = time.monotonic() - start
+        self.wait.observe(waited)
+        if waited >= _CONFIG['HTTP_QUEUE_WARN']:
+            _logger().warning('Waited %.2fs for a slot to %s', waited, self.host)
+        return waited
+
+    def exit(self) -> None:
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def status(self) -> dict[str, Any]:
+        return {
+            'queued': self.queued,
+            'in_flight': self.in_flight,
+            'tokens': self.bucket.tokens,
+            'queue_wait': self.wait.snapshot(),
+        }
+
+
+_BREAKERS: dict[str, CircuitBreaker] = {}
+_GOVERNORS: dict[str, HostGovernor | None] = {}
+
+
+def _breaker(host: str) -> CircuitBreaker:
+    breaker = _BREAKERS.get(host)
+    if breaker is None:
+        breaker = _BREAKERS[host] = CircuitBreaker(host)
+    return breaker
+
+
+def _governor(host: str) -> HostGovernor | None:
+    if host not in _GOVERNORS:
+        limits = _CONFIG['HTTP_HOST_LIMITS'].get(host)
+        _GOVERNORS[host] = None
+        if limits:
+            # requests past the connector's per-host limit would wait for a
+            # connection unseen by the governor, on the request's total timeout
+            concurrency = limits['concurrency']
+            if _CONFIG['HTTP_LIMIT_PER_HOST']:
+                concurrency = min(concurrency, _CONFIG['HTTP_LIMIT_PER_HOST'])
+            _GOVERNORS[host] = HostGovernor(
+                host, limits['rate'], limits['burst'], concurrency
+            )
+    return _GOVERNORS[host]
+
+
+def upstream_status() -> dict[str, dict[str, Any]]:
+    status: dict[str, dict[str, Any]] = {}
+    for host, breaker in _BREAKERS.items():
+        status.setdefault(host, {})['breaker'] = breaker.status()
+    for host, governor in _GOVERNORS.items():
+        if governor is not None:
+            status.setdefault(host, {})['limits'] = governor.status()
+    return dict(sorted(status.items()))
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter: uniform between 0 and the capped exponential delay
+    cap = min(
+        _CONFIG['HTTP_RETRY_MAX_BACKOFF'], _CONFIG['HTTP_RETRY_BACKOFF'] * 2**attempt
+    )
+    return random.uniform(0, cap)
+
+
+class _UpstreamRequest:
+    __slots__ = (
+        '_client',
+        '_method',
+        '_url',
+        '_idempotent',
+        '_kwargs',
+        '_trace_name',
+        '_response',
+        '_governor',
+        '_span',
+        'queue_wait',
+    )
 
-def get_session():
+    def __init__(
+        self,
+        client: 'HTTPClient',
+        method: str,
+        url: str,
+        idempotent: bool,
+        kwargs: dict[str, Any],
+        trace_name: str | None,
+    ):
+        self._client = client
+        self._method = method
+        self._url = url
+        self._idempotent = idempotent
+        self._kwargs = kwargs
+        self._trace_name = trace_name
+        self._response: ClientResponse | None = None
+        self._governor: HostGovernor | None = None
+        self._span: tracing.Span | None = None
+        self.queue_wait = 0.0
+
+    async def _send(self, host: str) -> ClientResponse:
+        breaker = _breaker(host)
+        attempts = _CONFIG['HTTP_RETRY_ATTEMPTS'] if self._idempotent else 1
+        for attempt in range(attempts):
+            last = attempt + 1 >= attempts
+            breaker.before_request()
+            if self._governor is not None:
+                start = time.monotonic()
+                await self._governor.bucket.acquire()
+                self.queue_wait += time.monotonic() - start
+            try:
+                response = await self._client.session.request(
+                    self._method, self._url, **self._kwargs
+                )
+            except (ClientConnectionError, asyncio.TimeoutError):
+                breaker.failure()
+                if last:
+                    raise
+            except BaseException:
+                breaker.probing = False
+                raise
+            else:
+                if response.status >= 500:
+                    breaker.failure()
+                else:
+                    breaker.success()
+                if last or response.status not in RETRY_STATUSES:
+                    return response
+                response.release()
+            await asyncio.sleep(_backoff(attempt))
+        raise AssertionError('unreachable')
+
+    async def __aenter__(self) -> ClientResponse:
+        url = URL(self._url)
+        host = url.host or ''
+        self._span = tracing.start_span(
+            'upstream', self._trace_name or f'{self._method} {url.path}', host
+        )
+        if _FIXTURES is not None and _FIXTURES.mode == 'replay':
+            try:
+                self._response = await _FIXTURES.replay(
+                    self._client.cookie_jar, self._method, self._url, self._kwargs
+                )
+            except BaseException as e:
+                self._finish_span(type(e).__name__)
+                raise
+            return self._response
+        # the in-flight slot is held until the body has been consumed
+        self._governor = _governor(host)
+        if self._governor is not None:
+            self.queue_wait = await self._governor.enter()
+        try:
+            start = time.monotonic()
+            self._response = await self._send(host)
+            if _FIXTURES is not None:
+                await self._record(time.monotonic() - start)
+        except BaseException as e:
+            self._release()
+            self._finish_span(type(e).__name__)
+            raise
+        return self._response
+
+    async def _record(self, elapsed: float) -> None:
+        try:
+            await _FIXTURES.record(
+                self._method, self._url, self._kwargs, self._response, elapsed
+            )
+        except Exception:
+            _logger().warning(
+                'Failed to record %s %s', self._method, self._url, exc_info=True
+            )
+
+    def _finish_span(self, status: int | str) -> None:
+        span = self._span
+        if span is None:
+            return
+        self._span = None
+        span.status = status
+        span.wait = self.queue_wait
+        if isinstance(self._response, ClientResponse):
+            span.size = self._response.content.total_bytes
+        elif self._response is not None:
+            span.size = self._response.content_length
+        span.finish()
+
+    def _release(self) -> None:
+        if self._governor is not None:
+            self._governor.exit()
+            self._governor = None
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        if self._response is not None:
+            self._finish_span(self._response.status)
+            self._response.release()
+        self._release()
+
+
+class UpstreamResponse(ClientResponse):
+    async def json(self, *, loads: Any = jsoncodec.loads, **kwargs: Any) -> Any:
+        return await super().json(loads=loads, **kwargs)
+
+
+class HTTPClient:
+    __slots__ = ('session',)
+
+    def __init__(self, session: ClientSession):
+        self.session = session
+
+    @property
+    def cookie_jar(self):
+        return self.session.cookie_jar
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        idempotent: bool | None = None,
+        trace_name: str | None = None,
+        **kwargs: Any,
+    ) -> _UpstreamRequest:
+        # only idempotent requests are retried; POSTs that merely read (GraphQL
+        # queries, Learnosity 'get' actions) have to opt in. trace_name labels
+        # the call in Server-Timing, defaulting to the method and path.
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        return _UpstreamRequest(self, method, url, idempotent, kwargs, trace_name)
+
+    def get(self, url: str, **kwargs: Any) -> _UpstreamRequest:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> _UpstreamRequest:
+        return self.request('POST', url, **kwargs)
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+
+_CONFIG: dict[str, Any] = dict(DEFAULT_CONFIG)
+_CONNECTOR: TCPConnector | None = None
+_FIXTURES: FixtureStore | None = None
+SESSION: HTTPClient = None  # type: ignore
+
+
+def _connector() -> TCPConnector:
+    global _CONNECTOR
+    if _CONNECTOR is None or _CONNECTOR.closed:
+        _CONNECTOR = TCPConnector(
+            limit=_CONFIG['HTTP_LIMIT'],
+            limit_per_host=_CONFIG['HTTP_LIMIT_PER_HOST'],
+            keepalive_timeout=_CONFIG['HTTP_KEEPALIVE_TIMEOUT'],
+            use_dns_cache=True,
+            ttl_dns_cache=_CONFIG['HTTP_DNS_TTL'],
+        )
+    return _CONNECTOR
+
+
+def _client_session(**kwargs: Any) -> ClientSession:
+    timeout = ClientTimeout(
+        total=_CONFIG['HTTP_TOTAL_TIMEOUT'],
+        sock_connect=_CONFIG['HTTP_CONNECT_TIMEOUT'],
+        sock_read=_CONFIG['HTTP_READ_TIMEOUT'],
+    )
+    return ClientSession(
+        connector=_connector(),
+        connector_owner=False,
+        headers=HEADERS,
+        timeout=timeout,
+        json_serialize=jsoncodec.dumps,
+        response_class=UpstreamResponse,
+        **kwargs,
+    )
+
+
+def get_session() -> HTTPClient:
     global SESSION
-    if SESSION is None:
-        SESSION = ClientSession(headers=HEADERS)
+    if SESSION is None or SESSION.session.closed:
+        SESSION = HTTPClient(_client_session())
     return SESSION
+
+
+def new_session() -> HTTPClient:
+    # shares the pooled connections of the global client, but keeps its own
+    # cookies; use as `async with new_session() as sess:`
+    return HTTPClient(_client_session(cookie_jar=CookieJar()))
+
+
+async def close_session() -> None:
+    global SESSION, _CONNECTOR
+    if SESSION is not None:
+        await SESSION.close()
+        SESSION = None  # type: ignore
+    if _CONNECTOR is not None:
+        await _CONNECTOR.close()
+        _CONNECTOR = None
+
+
+def init_client(app: Quart) -> None:
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.before_serving
+    async def _start_client():
+        global _FIXTURES
+        await close_session()
+        _CONFIG.update({key: app.config[key] for key in DEFAULT_CONFIG})
+        _GOVERNORS.clear()
+        _FIXTURES = None
+        if _CONFIG['UPSTREAM_MODE'] != 'live':
+            _FIXTURES = FixtureStore(
+                _CONFIG['UPSTREAM_FIXTURES'],
+                _CONFIG['UPSTREAM_MODE'],
+                _CONFIG['UPSTREAM_REPLAY_LATENCY'],
+            )
+            app.logger.warning(
+                'Upstream %s mode, fixtures in %s',
+                _CONFIG['UPSTREAM_MODE'],
+                _CONFIG['UPSTREAM_FIXTURES'],
+            )
+        get_session()
+
+    @app.after_serving
+    async def _close_client():
+        await close_session()
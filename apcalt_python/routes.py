@@ -1,20 +1,25 @@
+import hmac
 import uuid
 from functools import wraps
 from typing import Any, Awaitable, Callable, TypeVar, cast
 
-from quart import Response, g, request, session
+from quart import Quart, Response, current_app, g, request, session
 from quart.typing import RouteCallable, ResponseReturnValue
+from quart.wrappers import Request
 
-from apcalt_python.apc.auth import APCAuth
+from apcalt_python.apc.auth import APCAuth, load_auth
 
 from .decorator import allow_anonymous
 from .exceptions import BusinessError
 from .log import get_logger as _logger
+from .metrics import CACHE_METRICS
+from .request import upstream_status
+from .warmup import warm_assignments
 
 CallableT = TypeVar('CallableT', bound=RouteCallable)
 AsyncRouteCallable = Callable[..., Awaitable[ResponseReturnValue]]
 
-__all__ = ['ROUTES']
+__all__ = ['ROUTES', 'is_admin']
 
 ROUTES = []
 
@@ -47,21 +52,39 @@ def _flag(
 
 async def _auth() -> APCAuth:
     if 'auth' not in g:
-        raise BusinessError('Please login first', 401)
+        auth = await load_auth(session.get('auth'))
+        if auth is None:
+            # the shared credentials expired or were dropped from the store
+            if 'auth' in session:
+                del session['auth']
+            raise BusinessError('Please login first', 401)
+        g.auth = auth
     auth: APCAuth = g.auth
     try:
         await auth.ensure_account()
     except BusinessError as e:
         if e.code == 401:
-            try:
-                await auth.logout()
-            except:
-                pass
             del g.auth
+            session.pop('auth', None)
         raise
     return auth
 
 
+def is_admin(app: Quart, req: Request) -> bool:
+    token = app.config.get('ADMIN_TOKEN')
+    if not token:
+        return False
+    given = req.headers.get('Authorization', '').removeprefix('Bearer ')
+    return hmac.compare_digest(given.encode(), token.encode())
+
+
+def _admin() -> None:
+    if not current_app.config.get('ADMIN_TOKEN'):
+        raise BusinessError('Not found', 404)
+    if not is_admin(current_app, request):
+        raise BusinessError('Forbidden', 403)
+
+
 @_route('/ping')
 @allow_anonymous
 async def ping():
@@ -82,10 +105,9 @@ async def auth_login():
 
 @_route('/auth/logout')
 async def auth_logout():
-    if 'auth' in g:
-        auth: APCAuth = g.auth
-        await auth.logout()
-        del g.auth
+    # other sessions of the same user keep the shared credentials
+    g.pop('auth', None)
+    session.pop('auth', None)
     return {'code': 200}
 
 
@@ -104,7 +126,25 @@ async def subjects():
 @_route('/subjects/<id>/courseOutline')
 async def subject_outline(id: str):
     auth = await _auth()
-    return await auth.api.get_outline(id)
+    if request.args.get('slim', '') in ('', '0', 'false'):
+        return await auth.api.get_outline(id)
+    return await auth.api.get_outline_slim(
+        id,
+        request.args.get('offset', 0, type=int),
+        request.args.get('limit', None, type=int),
+    )
+
+
+@_route('/subjects/<id>/courseOutline/units/<unit_id>')
+async def subject_outline_unit(id: str, unit_id: str):
+    auth = await _auth()
+    return await auth.api.get_outline_unit(id, unit_id)
+
+
+@_route('/subjects/<id>/courseOutline/units/<unit_id>/subunits/<subunit_id>')
+async def subject_outline_subunit(id: str, unit_id: str, subunit_id: str):
+    auth = await _auth()
+    return await auth.api.get_outline_subunit(id, unit_id, subunit_id)
 
 
 @_route('/subjects/<id>/videos/<url>:<vid>/finish', methods=['POST'])
@@ -127,7 +167,20 @@ async def media_signed_url():
 async def subject_assignments(subject_id: str):
     auth = await _auth()
     status = request.args.get('status', 'assigned')
-    return await auth.api.list_assignments(subject_id, status)
+    assignments = await auth.api.list_assignments(subject_id, status)
+    if status == 'assigned':
+        warm_assignments(auth, subject_id, assignments)
+    return assignments
+
+
+@_route('/dashboard')
+async def dashboard():
+    auth = await _auth()
+    statuses = request.args.get('status', 'assigned').split(',')
+    return await auth.api.get_dashboard(
+        list(dict.fromkeys(filter(None, statuses))),
+        current_app.config['DASHBOARD_CONCURRENCY'],
+    )
 
 
 @_route('/subjects/<subject_id>/assignments/<id>/start', methods=['POST'])
@@ -150,6 +203,12 @@ async def assignment(subject_id: str, id: str):
     return await auth.api.get_assignment(subject_id, id)
 
 
+@_route('/subjects/<subject_id>/assignments/<id>/open')
+async def assignment_open(subject_id: str, id: str):
+    auth = await _auth()
+    return await auth.api.open_assignment(subject_id, id)
+
+
 @_route('/subjects/<subject_id>/assignments/<id>/responses/raw')
 async def assignment_responses_raw(subject_id: str, id: str):
     auth = await _auth()
@@ -305,6 +364,28 @@ async def health():
     return Response(status=200)
 
 
+@_route('/admin/cache')
+@allow_anonymous
+async def admin_cache():
+    _admin()
+    return CACHE_METRICS.snapshot()
+
+
+@_route('/admin/cache', methods=['DELETE'])
+@allow_anonymous
+async def admin_cache_reset():
+    _admin()
+    CACHE_METRICS.reset()
+    return {'code': 200}
+
+
+@_route('/admin/upstreams')
+@allow_anonymous
+async def admin_upstreams():
+    _admin()
+    return upstream_status()
+
+
 @_route('/test')
 @allow_anonymous
 async def test():
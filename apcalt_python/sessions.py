@@ -1,10 +1,23 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import math
 import os
 import pickle
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
 import time
 import uuid
-from typing import Any, ClassVar, Protocol, Type
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, ClassVar, Protocol, Type
 
-import aiofiles
 from quart import Quart
 from quart.sessions import SecureCookieSession, SessionInterface
 from quart.sessions import SessionMixin
@@ -15,6 +28,9 @@ from redis import asyncio as aioredis
 from werkzeug.wrappers import Response as WerkzeugResponse
 from werkzeug.wrappers.response import Response as WerkzeugResponse
 
+from . import jsoncodec, tracing
+from .metrics import CACHE_METRICS, key_prefix
+
 
 class Session:
     _app: Quart | None
@@ -43,12 +59,32 @@ class Session:
         config.setdefault('SESSION_REDIS', None)
         config.setdefault('SESSION_FILE_PATH', os.path.join(os.getcwd(), 'quart_store'))
         config.setdefault('SESSION_FILE_MODE', 384)
+        config.setdefault('SESSION_SERIALIZER', 'pickle')
+        config.setdefault('SESSION_FILE_SWEEP_INTERVAL', 600)
+        config.setdefault('SESSION_FILE_MAX_BYTES', 512 * 1024 * 1024)
+        # besides sessions, keys whose loss logs users out; backends never
+        # evict them for space while cache entries are left
+        config.setdefault('SESSION_DURABLE_PREFIXES', ('credentials.',))
+        config.setdefault(
+            'SESSION_SQLITE_PATH', os.path.join(os.getcwd(), 'quart_store.sqlite3')
+        )
+        config.setdefault('SESSION_SQLITE_WORKERS', 4)
+        config.setdefault('SESSION_SQLITE_SWEEP_INTERVAL', 300)
+        config.setdefault('SESSION_SQLITE_SWEEP_BATCH', 500)
+        config.setdefault('SESSION_MEMORY_MAX_ENTRIES', 10000)
+        config.setdefault('SESSION_MEMORY_MAX_BYTES', None)
+        config.setdefault('SESSION_L1_MAX_ENTRIES', 0)
+        config.setdefault('SESSION_L1_TTL', 30)
+        config.setdefault('SESSION_L1_CHANNEL', 'session:l1-invalidate')
+        # unchanged sessions have their expiry extended at most this often
+        config.setdefault('SESSION_TOUCH_INTERVAL', 300)
 
         session_type = config['SESSION_TYPE']
         session_interface = None
         interfaces: dict[str, Type[BaseSessionInterface]] = {
             'filesystem': FileSystemSessionInterface,
             'redis': RedisSessionInterface,
+            'sqlite': SQLiteSessionInterface,
             'memory': MemorySessionInterface,
             'null': MemorySessionInterface,
         }
@@ -57,8 +93,23 @@ class Session:
         else:
             raise ValueError(f'Unknown session type {session_type}')
 
+        serializer = config['SESSION_SERIALIZER']
+        if isinstance(serializer, str):
+            if serializer not in CODECS:
+                raise ValueError(f'Unknown session serializer {serializer}')
+            serializer = CODECS[serializer]
+        session_interface.serializer = serializer
+
         app.session_interface = session_interface  # type: ignore
 
+        @app.before_serving
+        async def _session_startup():
+            await session_interface.startup(app)
+
+        @app.after_serving
+        async def _session_shutdown():
+            await session_interface.shutdown(app)
+
 
 class BaseSession(SecureCookieSession):
     def __init__(
@@ -71,6 +122,9 @@ class BaseSession(SecureCookieSession):
         self.sid = sid
         if permanent:
             self.permanent = permanent
+        # setting permanent writes to the dict; a freshly loaded session is
+        # unchanged until the view touches it
+        self.modified = False
 
 
 class Serializer(Protocol):
@@ -81,12 +135,266 @@ class Serializer(Protocol):
         ...
 
 
+_CODEC_ENCODERS: dict[type, tuple[str, Callable[[Any], Any]]] = {}
+_CODEC_DECODERS: dict[str, Callable[[Any], Any]] = {}
+# tags whose encoded form may itself contain tagged values
+_CODEC_NESTED: set[str] = set()
+
+
+def register_codec_type(
+    cls: type,
+    tag: str,
+    encode: Callable[[Any], Any],
+    decode: Callable[[Any], Any],
+    nested: bool = False,
+) -> None:
+    _CODEC_ENCODERS[cls] = (tag, encode)
+    _CODEC_DECODERS[tag] = decode
+    if nested:
+        _CODEC_NESTED.add(tag)
+
+
+register_codec_type(datetime, 'datetime', datetime.isoformat, datetime.fromisoformat)
+
+
+class PickleCodec:
+    def loads(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+class JSONCodec:
+    # Blobs are prefixed with a format byte: b'J' plain JSON, b'Z' zlib
+    # compressed JSON, b'P' pickle for values holding unregistered types.
+    # Legacy pickle blobs (starting with the protocol opcode) still load.
+    # A compress_min_size of None never compresses.
+
+    def __init__(self, compress_min_size: int | None = 512, compress_level: int = 1):
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+
+    @staticmethod
+    def _default(obj: Any) -> Any:
+        try:
+            tag, encode = _CODEC_ENCODERS[type(obj)]
+        except KeyError:
+            raise TypeError(f'Cannot encode {type(obj).__name__}') from None
+        return {'__codec__': tag, 'v': encode(obj)}
+
+    @classmethod
+    def _revive(cls, value: Any) -> Any:
+        # decoding runs at C speed; only the containers leading to tagged
+        # values are visited here, and payloads only for nested tags
+        if isinstance(value, dict):
+            tag = value.get('__codec__')
+            if tag is not None:
+                encoded = value['v']
+                if tag in _CODEC_NESTED:
+                    encoded = cls._revive(encoded)
+                return _CODEC_DECODERS[tag](encoded)
+            for key, item in value.items():
+                if isinstance(item, (dict, list)):
+                    value[key] = cls._revive(item)
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                if isinstance(item, (dict, list)):
+                    value[index] = cls._revive(item)
+        return value
+
+    def dumps(self, value: Any) -> bytes:
+        try:
+            data = jsoncodec.dumpb(value, default=self._default, strict=True)
+        except TypeError:
+            return b'P' + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self.compress_min_size is None or len(data) < self.compress_min_size:
+            return b'J' + data
+        return b'Z' + zlib.compress(data, self.compress_level)
+
+    def loads(self, data: bytes) -> Any:
+        kind, body = data[:1], data[1:]
+        if kind == b'Z':
+            body = zlib.decompress(body)
+        elif kind == b'P':
+            return pickle.loads(body)
+        elif kind != b'J':
+            return pickle.loads(data)
+        value = jsoncodec.loads(body)
+        if b'"__codec__"' not in body:
+            return value
+        return self._revive(value)
+
+
+# zlib costs several times the encoding itself; 'zjson' trades that time for
+# smaller blobs on backends where size matters more
+CODECS: dict[str, Serializer] = {
+    'pickle': PickleCodec(),
+    'json': JSONCodec(None),
+    'zjson': JSONCodec(),
+}
+
+
+def _pickled_size(value: Any) -> int:
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class _MemoryEntry:
+    __slots__ = ('data', 'expiry', 'size', 'seq')
+
+    def __init__(self, data: Any, expiry: float | None, size: int, seq: int):
+        self.data = data
+        self.expiry = expiry
+        self.size = size
+        self.seq = seq
+
+
+class MemoryStore:
+    # LRU order lives in the OrderedDict, expiry deadlines in a min-heap of
+    # (deadline, seq, key). Heap items are invalidated lazily: an item is only
+    # acted upon if its seq still matches the live entry for that key.
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        sizer: Callable[[Any], int] = _pickled_size,
+        on_evict: Callable[[str], None] | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizer = sizer
+        self._on_evict = on_evict
+        self._entries: OrderedDict[str, _MemoryEntry] = OrderedDict()
+        self._heap: list[tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str) -> _MemoryEntry:
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        return entry
+
+    def _purge_expired(self, now: float) -> None:
+        heap = self._heap
+        entries = self._entries
+        while heap and heap[0][0] <= now:
+            _, seq, key = heapq.heappop(heap)
+            entry = entries.get(key)
+            if entry is not None and entry.seq == seq:
+                self._remove(key)
+
+    def _compact(self) -> None:
+        if len(self._heap) <= 2 * len(self._entries) + 64:
+            return
+        self._heap = [
+            (entry.expiry, entry.seq, key)
+            for key, entry in self._entries.items()
+            if entry.expiry is not None
+        ]
+        heapq.heapify(self._heap)
+
+    def _evict(self) -> None:
+        entries = self._entries
+        while entries and (
+            self.max_entries is not None
+            and len(entries) > self.max_entries
+            or self.max_bytes is not None
+            and self.bytes > self.max_bytes
+        ):
+            key = next(iter(entries))
+            self._remove(key)
+            if self._on_evict is not None:
+                self._on_evict(key)
+
+    def _lookup(self, key: str) -> _MemoryEntry | None:
+        self._purge_expired(time.time())
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def has(self, key: str) -> bool:
+        return self._lookup(key) is not None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._lookup(key)
+        if entry is None:
+            return default
+        return entry.data
+
+    def set(self, key: str, value: Any, expiry: int | None = None) -> None:
+        now = time.time()
+        self._purge_expired(now)
+        if key in self._entries:
+            self._remove(key)
+        size = self._sizer(value) if self.max_bytes is not None else 0
+        deadline = None if expiry is None else now + expiry
+        seq = next(self._seq)
+        self._entries[key] = _MemoryEntry(value, deadline, size, seq)
+        self.bytes += size
+        if deadline is not None:
+            heapq.heappush(self._heap, (deadline, seq, key))
+        self._evict()
+        self._compact()
+
+    def touch(self, key: str, expiry: int | None) -> None:
+        entry = self._lookup(key)
+        if entry is not None:
+            self.set(key, entry.data, expiry)
+
+    def delete(self, key: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._compact()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._heap.clear()
+        self.bytes = 0
+
+
 class BaseSessionInterface(SessionInterface):
     session_class: ClassVar[Type[BaseSession]]
     pickle_based: ClassVar[bool] = False
+    serializer: Serializer = CODECS['pickle']
 
     def __init__(self, config: dict[str, Any]) -> None:
         self.config = config
+        self.l1: MemoryStore | None = None
+        self._touched = MemoryStore(max_entries=100000)
+
+    def _init_l1(self) -> None:
+        max_entries = self.config['SESSION_L1_MAX_ENTRIES']
+        if max_entries:
+            self.l1 = MemoryStore(max_entries)
+
+    def _l1_for(self, key: str) -> MemoryStore | None:
+        # sessions are small and rewritten on every change; only cache entries
+        # are worth keeping in the per-worker tier
+        if key.startswith(self.config['SESSION_KEY_PREFIX']):
+            return None
+        return self.l1
+
+    def _durable(self, key: str) -> bool:
+        prefixes = self.config['SESSION_DURABLE_PREFIXES']
+        return key.startswith((self.config['SESSION_KEY_PREFIX'], *prefixes))
+
+    def _l1_ttl(self, expiry: int | None) -> int:
+        ttl = self.config['SESSION_L1_TTL']
+        return ttl if expiry is None else min(ttl, expiry)
+
+    async def startup(self, app: Quart) -> None:
+        pass
+
+    async def shutdown(self, app: Quart) -> None:
+        pass
 
     async def open_session(
         self, app: Quart, request: BaseRequestWebsocket
@@ -113,7 +421,7 @@ class BaseSessionInterface(SessionInterface):
         session: BaseSession,
         response: QuartResponse | WerkzeugResponse | None,
     ) -> None:
-        if not session.modified or response is None:
+        if response is None or not self.should_set_cookie(app, session):
             return
 
         cname = self.config['SESSION_COOKIE_NAME']
@@ -130,8 +438,16 @@ class BaseSessionInterface(SessionInterface):
         samesite = self.get_cookie_samesite(app)
         secure = self.get_cookie_secure(app)
         expires = self.get_expiration_time(app, session)
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
 
-        await self.set(key, dict(session), app)
+        interval = self.config['SESSION_TOUCH_INTERVAL']
+        if session.modified:
+            await self.set(key, dict(session), app, lifetime)
+            self._touched.set(key, True, interval)
+        elif not self._touched.has(key):
+            # sliding expiry: extend the lifetime without rewriting the blob
+            await self.touch(key, lifetime, app)
+            self._touched.set(key, True, interval)
         response.set_cookie(
             cname,
             session.sid,
@@ -148,32 +464,108 @@ class BaseSessionInterface(SessionInterface):
 
     # should return dict[str, Any] for session keys
     async def get(self, key: str, app: Quart) -> Any:
-        raise NotImplementedError
+        start = time.perf_counter()
+        with tracing.span('cache', f'get {key_prefix(key)}') as span:
+            value = await self._get(key, app)
+            if span is not None:
+                span.status = 'miss' if value is None else 'hit'
+        CACHE_METRICS.get_latency(key, time.perf_counter() - start)
+        return value
 
     # value will be dict[str, Any] for session keys
     async def set(
         self, key: str, value: Any, app: Quart, expiry: int | None = None
     ) -> None:
-        raise NotImplementedError
+        start = time.perf_counter()
+        with tracing.span('cache', f'set {key_prefix(key)}'):
+            await self._set(key, value, app, expiry)
+        CACHE_METRICS.set_latency(key, time.perf_counter() - start)
+
+    async def get_many(self, keys: list[str], app: Quart) -> list[Any]:
+        start = time.perf_counter()
+        with tracing.span('cache', f'get_many {len(keys)}') as span:
+            values = await self._get_many(keys, app)
+            if span is not None:
+                span.status = f'{sum(v is not None for v in values)} hit'
+        elapsed = time.perf_counter() - start
+        for key in keys:
+            CACHE_METRICS.get_latency(key, elapsed)
+        return values
+
+    async def set_many(
+        self, items: dict[str, Any], app: Quart, expiry: int | None = None
+    ) -> None:
+        start = time.perf_counter()
+        with tracing.span('cache', f'set_many {len(items)}'):
+            await self._set_many(items, app, expiry)
+        elapsed = time.perf_counter() - start
+        for key in items:
+            CACHE_METRICS.set_latency(key, elapsed)
 
     async def delete(self, key: str, app: Quart) -> None:
         raise NotImplementedError
 
+    async def touch(self, key: str, expiry: int, app: Quart) -> None:
+        raise NotImplementedError
+
+    async def _get(self, key: str, app: Quart) -> Any:
+        raise NotImplementedError
+
+    async def _set(
+        self, key: str, value: Any, app: Quart, expiry: int | None = None
+    ) -> None:
+        raise NotImplementedError
+
+    async def _get_many(self, keys: list[str], app: Quart) -> list[Any]:
+        return list(await asyncio.gather(*(self._get(key, app) for key in keys)))
+
+    async def _set_many(
+        self, items: dict[str, Any], app: Quart, expiry: int | None = None
+    ) -> None:
+        await asyncio.gather(
+            *(self._set(key, value, app, expiry) for key, value in items.items())
+        )
+
+    def _dumps(self, key: str, value: Any) -> bytes:
+        data = self.serializer.dumps(value)
+        CACHE_METRICS.write(key, len(data))
+        tracing.add_bytes(len(data))
+        return data
+
+    def _loads(self, key: str, data: bytes) -> Any:
+        CACHE_METRICS.read(key, len(data))
+        tracing.add_bytes(len(data))
+        return self.serializer.loads(data)
+
 
 class FileSystemSession(BaseSession):
     pass
 
 
-class ExpiryData:
+_MISSING = object()
+
+
+def _deadline(expiry: int | None) -> float | None:
+    if expiry is None:
+        return None
+    return time.time() + expiry
+
+
+# every file starts with its absolute expiry deadline (inf for none), so the
+# sweeper can check expiry without reading the payload
+_FILE_HEADER = struct.Struct('<d')
+
+
+class _FlatEntry:
+    # what the flat file layout pickled as ExpiryData(data, expiry)
     __slots__ = ('expiry', 'data')
 
-    def __init__(self, data: Any, expiry: float | None = None):
-        self.expiry = expiry
-        self.data = data
 
-    @property
-    def expired(self):
-        return self.expiry is not None and self.expiry < time.time()
+class _FlatUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str) -> Any:
+        if module == __name__ and name == 'ExpiryData':
+            return _FlatEntry
+        return super().find_class(module, name)
 
 
 class FileSystemSessionInterface(BaseSessionInterface):
@@ -182,50 +574,240 @@ class FileSystemSessionInterface(BaseSessionInterface):
 
     def __init__(self, config: dict[str, Any]) -> None:
         super().__init__(config)
-        path = self.config['SESSION_FILE_PATH']
-        os.makedirs(path, exist_ok=True)
+        self.path = self.config['SESSION_FILE_PATH']
+        os.makedirs(self.path, exist_ok=True)
+        self._init_l1()
+        self._sweeper: asyncio.Task | None = None
+
+    def _file_path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        suffix = '.keep' if self._durable(key) else '.bin'
+        return os.path.join(self.path, digest[:2], digest[2:4], digest + suffix)
+
+    @classmethod
+    def _read_unmarked(cls, file_path: str) -> Any:
+        # durable entries written before they had their own suffix
+        try:
+            os.replace(file_path.removesuffix('.keep') + '.bin', file_path)
+        except FileNotFoundError:
+            return None
+        return cls._read_file(file_path)
+
+    @staticmethod
+    def _read_file(
+        file_path: str,
+        known_generation: tuple[int, int] | None = None,
+        header_only: bool = False,
+    ) -> tuple[tuple[int, int], float, bytes | None] | None:
+        try:
+            with open(file_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                # every write replaces the file, so the inode changes even when
+                # two writes land within the same mtime tick
+                generation = (stat.st_ino, stat.st_mtime_ns)
+                (deadline,) = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+                if header_only or generation == known_generation:
+                    return generation, deadline, None
+                return generation, deadline, f.read()
+        except FileNotFoundError:
+            return None
+        except struct.error:
+            return generation, 0.0, b''
+
+    def _write_file(self, file_path: str, deadline: float, data: bytes) -> None:
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_FILE_HEADER.pack(deadline))
+                f.write(data)
+            os.chmod(tmp_path, self.config['SESSION_FILE_MODE'])
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            _unlink_quietly(tmp_path)
+            raise
 
     async def has(self, key: str, app: Quart) -> bool:
-        fname = key.replace('/', '__') + '.bin'
-        path = self.config['SESSION_FILE_PATH']
-        file_path = os.path.join(path, fname)
-        return os.path.isfile(file_path)
+        result = await asyncio.to_thread(
+            self._read_file, self._file_path(key), None, True
+        )
+        return result is not None and result[1] >= time.time()
 
-    async def get(self, key: str, app: Quart) -> Any:
-        fname = key.replace('/', '__') + '.bin'
-        path = self.config['SESSION_FILE_PATH']
-        file_path = os.path.join(path, fname)
-        if not os.path.isfile(file_path):
+    async def _get(self, key: str, app: Quart) -> Any:
+        file_path = self._file_path(key)
+        l1 = self._l1_for(key)
+        hit = _MISSING if l1 is None else l1.get(key, _MISSING)
+        # the file's inode and mtime act as a generation shared by all workers
+        known_generation = None if hit is _MISSING else hit[0]
+        result = await asyncio.to_thread(self._read_file, file_path, known_generation)
+        if result is None and file_path.endswith('.keep'):
+            result = await asyncio.to_thread(self._read_unmarked, file_path)
+        if result is None:
+            if l1 is not None:
+                l1.delete(key)
             return
-        async with aiofiles.open(file_path, 'rb') as f:
-            data = await f.read()
-        try:
-            expiry_data: ExpiryData = pickle.loads(data)
-        except:
+        generation, deadline, data = result
+        if deadline < time.time():
             await self.delete(key, app)
             return
-        if expiry_data.expired:
+        if data is None:
+            CACHE_METRICS.l1_hit(key)
+            return hit[1]
+        try:
+            value = self._loads(key, data)
+        except:
             await self.delete(key, app)
             return
-        return expiry_data.data
+        if l1 is not None:
+            ttl = self.config['SESSION_L1_TTL']
+            l1.set(key, (generation, value), min(ttl, deadline - time.time()))
+        return value
 
-    async def set(
+    async def _set(
         self, key: str, value: Any, app: Quart, expiry: int | None = None
     ) -> None:
-        fname = key.replace('/', '__') + '.bin'
-        path = self.config['SESSION_FILE_PATH']
-        file_path = os.path.join(path, fname)
-        expiry_data = ExpiryData(value, expiry)
-        data = pickle.dumps(expiry_data)
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(data)
+        deadline = _deadline(expiry)
+        data = self._dumps(key, value)
+        await asyncio.to_thread(
+            self._write_file,
+            self._file_path(key),
+            math.inf if deadline is None else deadline,
+            data,
+        )
+        if self.l1 is not None:
+            self.l1.delete(key)
 
     async def delete(self, key: str, app: Quart) -> None:
-        fname = key.replace('/', '__') + '.bin'
-        path = self.config['SESSION_FILE_PATH']
-        file_path = os.path.join(path, fname)
-        if os.path.isfile(file_path):
-            os.unlink(file_path)
+        await asyncio.to_thread(_unlink_quietly, self._file_path(key))
+        if self.l1 is not None:
+            self.l1.delete(key)
+
+    @staticmethod
+    def _touch_file(file_path: str, deadline: float) -> None:
+        try:
+            with open(file_path, 'r+b') as f:
+                f.write(_FILE_HEADER.pack(deadline))
+        except FileNotFoundError:
+            pass
+
+    async def touch(self, key: str, expiry: int, app: Quart) -> None:
+        await asyncio.to_thread(
+            self._touch_file, self._file_path(key), time.time() + expiry
+        )
+
+    async def startup(self, app: Quart) -> None:
+        migrated = await asyncio.to_thread(self.migrate_flat_files)
+        if migrated:
+            app.logger.info('Moved %d session files to the sharded layout', migrated)
+        if self.config['SESSION_FILE_SWEEP_INTERVAL']:
+            self._sweeper = asyncio.create_task(self._sweep_forever(app))
+
+    async def shutdown(self, app: Quart) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_forever(self, app: Quart) -> None:
+        while True:
+            try:
+                removed, size = await asyncio.to_thread(self.sweep)
+                if removed:
+                    app.logger.info(
+                        'Session sweeper removed %d files, %d bytes left', removed, size
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                app.logger.exception('Session sweeper failed')
+            await asyncio.sleep(self.config['SESSION_FILE_SWEEP_INTERVAL'])
+
+    def migrate_flat_files(self) -> int:
+        # The flat layout stored pickled ExpiryData under <key, / as __>.bin.
+        # Entries without an expiry, which includes every session, are moved
+        # to the sharded layout; the others were never readable (their expiry
+        # was relative) and are dropped.
+        lifetime = self.config['PERMANENT_SESSION_LIFETIME']
+        if not isinstance(lifetime, (int, float)):
+            lifetime = lifetime.total_seconds()
+        migrated = 0
+        for entry in os.scandir(self.path):
+            if not entry.is_file() or not entry.name.endswith('.bin'):
+                continue
+            key = entry.name.removesuffix('.bin').replace('__', '/')
+            try:
+                with open(entry.path, 'rb') as f:
+                    flat = _FlatUnpickler(f).load()
+                keep = isinstance(flat, _FlatEntry) and flat.expiry is None
+            except FileNotFoundError:
+                continue
+            except Exception:
+                keep = False
+            if keep:
+                if key.startswith(self.config['SESSION_KEY_PREFIX']):
+                    deadline = time.time() + lifetime
+                else:
+                    deadline = math.inf
+                data = self._dumps(key, flat.data)
+                self._write_file(self._file_path(key), deadline, data)
+                migrated += 1
+            _unlink_quietly(entry.path)
+        return migrated
+
+    def sweep(self) -> tuple[int, int]:
+        now = time.time()
+        removed = 0
+        live: list[tuple[bool, int, int, str]] = []
+        for entry in os.scandir(self.path):
+            if not entry.is_dir():
+                continue
+            for shard in os.scandir(entry.path):
+                if not shard.is_dir():
+                    continue
+                for file in os.scandir(shard.path):
+                    try:
+                        stat = file.stat()
+                        if file.name.endswith('.tmp'):
+                            # a write that never completed
+                            if stat.st_mtime < now - 3600:
+                                removed += _unlink_quietly(file.path)
+                            continue
+                        with open(file.path, 'rb') as f:
+                            header = f.read(_FILE_HEADER.size)
+                    except FileNotFoundError:
+                        continue
+                    if (
+                        len(header) != _FILE_HEADER.size
+                        or _FILE_HEADER.unpack(header)[0] < now
+                    ):
+                        removed += _unlink_quietly(file.path)
+                    else:
+                        durable = file.name.endswith('.keep')
+                        live.append(
+                            (durable, stat.st_mtime_ns, stat.st_size, file.path)
+                        )
+        size = sum(item[2] for item in live)
+        max_bytes = self.config['SESSION_FILE_MAX_BYTES']
+        if max_bytes is not None and size > max_bytes:
+            # cache files before sessions and credentials, each least recently
+            # written first
+            live.sort()
+            for _, _, file_size, file_path in live:
+                if size <= max_bytes:
+                    break
+                if _unlink_quietly(file_path):
+                    removed += 1
+                    CACHE_METRICS.eviction(None)
+                size -= file_size
+        return removed, size
+
+
+def _unlink_quietly(path: str) -> bool:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    return True
 
 
 class RedisSession(BaseSession):
@@ -243,26 +825,354 @@ class RedisSessionInterface(BaseSessionInterface):
             uri = config.get('SESSION_URI', 'redis://localhost')
             redis = aioredis.from_url(uri, decode_responses=False)
         self.redis = redis
+        self._init_l1()
+        self._worker_id = uuid.uuid4().hex
+        self._listener: asyncio.Task | None = None
+        self._subscribed = False
+
+    def _l1_for(self, key: str) -> MemoryStore | None:
+        # without a live subscription we would miss invalidations from other
+        # workers, so the local tier is bypassed entirely
+        if not self._subscribed:
+            return None
+        return super()._l1_for(key)
+
+    async def startup(self, app: Quart) -> None:
+        if self.l1 is not None:
+            self._listener = asyncio.create_task(self._listen(app))
+
+    async def shutdown(self, app: Quart) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        self._subscribed = False
+
+    async def _listen(self, app: Quart) -> None:
+        channel = self.config['SESSION_L1_CHANNEL']
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(channel)
+                    self._subscribed = True
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        origin, _, key = message['data'].decode().partition(' ')
+                        if origin != self._worker_id and self.l1 is not None:
+                            self.l1.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                app.logger.exception('L1 invalidation listener failed, retrying')
+            finally:
+                self._subscribed = False
+                if self.l1 is not None:
+                    self.l1.clear()
+            await asyncio.sleep(1)
+
+    def _invalidation(self, key: str) -> str:
+        return f'{self._worker_id} {key}'
 
     async def has(self, key: str, app: Quart) -> bool:
         return bool(await self.redis.exists(key))
 
-    async def get(self, key: str, app: Quart) -> Any:
-        data = await self.redis.get(key)
+    def _decode(self, key: str, data: bytes | None) -> Any:
+        if data is None:
+            return _MISSING
         try:
-            return pickle.loads(data)
+            return self._loads(key, data)
         except:
+            return None
+
+    async def _get(self, key: str, app: Quart) -> Any:
+        l1 = self._l1_for(key)
+        if l1 is not None:
+            hit = l1.get(key, _MISSING)
+            if hit is not _MISSING:
+                CACHE_METRICS.l1_hit(key)
+                return hit
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.ttl(key)
+                data, ttl = await pipe.execute()
+        else:
+            data = await self.redis.get(key)
+        value = self._decode(key, data)
+        if value is _MISSING:
+            return
+        if value is None:
             await self.delete(key, app)
             return
+        if l1 is not None:
+            l1.set(key, value, self._l1_ttl(ttl if ttl > 0 else None))
+        return value
 
-    async def set(
+    async def _set(
         self, key: str, value: Any, app: Quart, expiry: int | None = None
     ) -> None:
-        data = pickle.dumps(value)
-        await self.redis.set(key, data, expiry)
+        data = self._dumps(key, value)
+        l1 = self._l1_for(key)
+        if l1 is None:
+            await self.redis.set(key, data, expiry)
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, data, expiry)
+            pipe.publish(self.config['SESSION_L1_CHANNEL'], self._invalidation(key))
+            await pipe.execute()
+        l1.set(key, value, self._l1_ttl(expiry))
 
     async def delete(self, key: str, app: Quart) -> None:
-        await self.redis.delete(key)
+        l1 = self._l1_for(key)
+        if l1 is None:
+            await self.redis.delete(key)
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.delete(key)
+            pipe.publish(self.config['SESSION_L1_CHANNEL'], self._invalidation(key))
+            await pipe.execute()
+        l1.delete(key)
+
+    async def touch(self, key: str, expiry: int, app: Quart) -> None:
+        await self.redis.expire(key, expiry)
+
+    async def _get_many(self, keys: list[str], app: Quart) -> list[Any]:
+        values: list[Any] = [None] * len(keys)
+        pending: list[tuple[int, MemoryStore | None]] = []
+        for index, key in enumerate(keys):
+            l1 = self._l1_for(key)
+            hit = _MISSING if l1 is None else l1.get(key, _MISSING)
+            if hit is _MISSING:
+                pending.append((index, l1))
+            else:
+                CACHE_METRICS.l1_hit(key)
+                values[index] = hit
+        if not pending:
+            return values
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for index, _ in pending:
+                pipe.get(keys[index])
+                pipe.ttl(keys[index])
+            results = await pipe.execute()
+        broken = []
+        for (index, l1), data, ttl in zip(pending, results[::2], results[1::2]):
+            key = keys[index]
+            value = self._decode(key, data)
+            if value is _MISSING:
+                continue
+            if value is None:
+                broken.append(key)
+                continue
+            values[index] = value
+            if l1 is not None:
+                l1.set(key, value, self._l1_ttl(ttl if ttl > 0 else None))
+        if broken:
+            await self.redis.delete(*broken)
+        return values
+
+    async def _set_many(
+        self, items: dict[str, Any], app: Quart, expiry: int | None = None
+    ) -> None:
+        channel = self.config['SESSION_L1_CHANNEL']
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, self._dumps(key, value), expiry)
+                l1 = self._l1_for(key)
+                if l1 is not None:
+                    pipe.publish(channel, self._invalidation(key))
+                    l1.set(key, value, self._l1_ttl(expiry))
+            await pipe.execute()
+
+
+class SQLiteSession(BaseSession):
+    pass
+
+
+class SQLiteSessionInterface(BaseSessionInterface):
+    session_class = SQLiteSession
+    pickle_based = True
+
+    _LIVE = '(expiry IS NULL OR expiry >= ?)'
+
+    def __init__(self, config: dict[str, Any]) -> None:
+        super().__init__(config)
+        self.path = config['SESSION_SQLITE_PATH']
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._sweeper: asyncio.Task | None = None
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS store '
+            '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expiry REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS store_expiry ON store (expiry)')
+
+    def _new_executor(self) -> ThreadPoolExecutor:
+        # reads and writes run here so the event loop never waits on the disk;
+        # each worker thread owns one connection, and WAL lets readers proceed
+        # while another thread writes
+        return ThreadPoolExecutor(
+            self.config['SESSION_SQLITE_WORKERS'], thread_name_prefix='session-sqlite'
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _execute(self, sql: str, *params: Any) -> list[Any]:
+        return self._connection().execute(sql, params).fetchall()
+
+    def _execute_many(self, sql: str, rows: list[tuple[Any, ...]]) -> None:
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(sql, rows)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _delete_expired(self, now: float, batch: int) -> int:
+        cursor = self._connection().execute(
+            'DELETE FROM store WHERE rowid IN '
+            '(SELECT rowid FROM store WHERE expiry < ? LIMIT ?)',
+            (now, batch),
+        )
+        return cursor.rowcount
+
+    async def has(self, key: str, app: Quart) -> bool:
+        rows = await self._run(
+            self._execute,
+            f'SELECT 1 FROM store WHERE key = ? AND {self._LIVE}',
+            key,
+            time.time(),
+        )
+        return bool(rows)
+
+    async def _get(self, key: str, app: Quart) -> Any:
+        rows = await self._run(
+            self._execute,
+            f'SELECT value FROM store WHERE key = ? AND {self._LIVE}',
+            key,
+            time.time(),
+        )
+        if not rows:
+            return
+        try:
+            return self._loads(key, rows[0][0])
+        except:
+            await self.delete(key, app)
+            return
+
+    async def _get_many(self, keys: list[str], app: Quart) -> list[Any]:
+        if not keys:
+            return []
+        placeholders = ','.join('?' * len(keys))
+        rows = await self._run(
+            self._execute,
+            f'SELECT key, value FROM store WHERE key IN ({placeholders}) '
+            f'AND {self._LIVE}',
+            *keys,
+            time.time(),
+        )
+        found = {}
+        for key, data in rows:
+            try:
+                found[key] = self._loads(key, data)
+            except:
+                await self.delete(key, app)
+        return [found.get(key) for key in keys]
+
+    async def _set(
+        self, key: str, value: Any, app: Quart, expiry: int | None = None
+    ) -> None:
+        await self._set_many({key: value}, app, expiry)
+
+    async def _set_many(
+        self, items: dict[str, Any], app: Quart, expiry: int | None = None
+    ) -> None:
+        deadline = _deadline(expiry)
+        rows = [
+            (key, self._dumps(key, value), deadline) for key, value in items.items()
+        ]
+        await self._run(
+            self._execute_many,
+            'INSERT INTO store (key, value, expiry) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            'value = excluded.value, expiry = excluded.expiry',
+            rows,
+        )
+
+    async def delete(self, key: str, app: Quart) -> None:
+        await self._run(self._execute, 'DELETE FROM store WHERE key = ?', key)
+
+    async def touch(self, key: str, expiry: int, app: Quart) -> None:
+        await self._run(
+            self._execute,
+            'UPDATE store SET expiry = ? WHERE key = ?',
+            time.time() + expiry,
+            key,
+        )
+
+    async def startup(self, app: Quart) -> None:
+        if self.config['SESSION_SQLITE_SWEEP_INTERVAL']:
+            self._sweeper = asyncio.create_task(self._sweep_forever(app))
+
+    async def shutdown(self, app: Quart) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        # let queued work finish, then release the file handles and WAL locks
+        await asyncio.to_thread(self._executor.shutdown)
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        # threads are only started on demand, so this costs nothing unless the
+        # app is served again
+        self._local = threading.local()
+        self._executor = self._new_executor()
+
+    async def sweep(self) -> int:
+        batch = self.config['SESSION_SQLITE_SWEEP_BATCH']
+        now = time.time()
+        removed = 0
+        # small batches keep each write transaction, and thus the time other
+        # writers wait on the database lock, short
+        while True:
+            count = await self._run(self._delete_expired, now, batch)
+            removed += count
+            if count < batch:
+                return removed
+
+    async def _sweep_forever(self, app: Quart) -> None:
+        while True:
+            try:
+                removed = await self.sweep()
+                if removed:
+                    app.logger.info('Session sweeper removed %d entries', removed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                app.logger.exception('Session sweeper failed')
+            await asyncio.sleep(self.config['SESSION_SQLITE_SWEEP_INTERVAL'])
 
 
 class MemorySession(BaseSession):
@@ -270,34 +1180,35 @@ class MemorySession(BaseSession):
 
 
 class MemorySessionInterface(BaseSessionInterface):
-    session_class = RedisSession
+    session_class = MemorySession
 
     def __init__(self, config: dict[str, Any]) -> None:
         super().__init__(config)
-        self._storage: dict[str, ExpiryData] = {}
+        self._storage = MemoryStore(
+            config['SESSION_MEMORY_MAX_ENTRIES'],
+            config['SESSION_MEMORY_MAX_BYTES'],
+            on_evict=CACHE_METRICS.eviction,
+        )
+        # sessions and credentials only leave by expiry, so that cache traffic
+        # can't push logins out of the LRU
+        self._durable_storage = MemoryStore()
 
-    def _check_expiry(self):
-        for key in frozenset(self._storage):
-            value = self._storage[key]
-            if value.expired:
-                del self._storage[key]
+    def _store(self, key: str) -> MemoryStore:
+        return self._durable_storage if self._durable(key) else self._storage
 
-    async def has(self, key: str, app: Quart):
-        return key in self._storage
+    async def has(self, key: str, app: Quart) -> bool:
+        return self._store(key).has(key)
 
-    async def get(self, key: str, app: Quart):
-        self._check_expiry()
-        value = self._storage.get(key)
-        if value is not None:
-            return value.data
+    async def _get(self, key: str, app: Quart) -> Any:
+        return self._store(key).get(key)
 
-    async def set(
+    async def _set(
         self, key: str, value: Any, app: Quart, expiry: int | None = None
     ) -> None:
-        self._check_expiry()
-        expiry_data = ExpiryData(value, expiry)
-        self._storage[key] = expiry_data
+        self._store(key).set(key, value, expiry)
 
     async def delete(self, key: str, app: Quart) -> None:
-        if key in self._storage:
-            del self._storage[key]
+        self._store(key).delete(key)
+
+    async def touch(self, key: str, expiry: int, app: Quart) -> None:
+        self._store(key).touch(key, expiry)
@@ -0,0 +1,142 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+__all__ = [
+    'Span',
+    'Trace',
+    'add_bytes',
+    'current_trace',
+    'span',
+    'start_span',
+    'trace',
+]
+
+
+class Span:
+    __slots__ = ('kind', 'name', 'host', 'status', 'start', 'duration', 'size', 'wait')
+
+    def __init__(self, kind: str, name: str, host: str | None = None):
+        self.kind = kind
+        self.name = name
+        self.host = host
+        self.status: int | str | None = None
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.size: int | None = None
+        self.wait = 0.0
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.start
+
+    def as_dict(self, origin: float) -> dict[str, Any]:
+        data: dict[str, Any] = {
+            'kind': self.kind,
+            'name': self.name,
+            'offset_ms': round((self.start - origin) * 1e3, 2),
+            'ms': round(self.duration * 1e3, 2),
+        }
+        if self.host is not None:
+            data['host'] = self.host
+        if self.status is not None:
+            data['status'] = self.status
+        if self.size is not None:
+            data['bytes'] = self.size
+        if self.wait:
+            data['wait_ms'] = round(self.wait * 1e3, 2)
+        return data
+
+    def describe(self) -> str:
+        parts = [str(part) for part in (self.host, self.name, self.status) if part]
+        if self.size is not None:
+            parts.append(f'{self.size}B')
+        if self.wait:
+            parts.append(f'wait={self.wait * 1e3:.1f}ms')
+        return ' '.join(parts).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Trace:
+    __slots__ = ('start', 'duration', 'spans')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: list[Span] = []
+
+    def totals(self) -> dict[str, float]:
+        totals: dict[str, float] = {}
+        for span in self.spans:
+            totals[span.kind] = totals.get(span.kind, 0.0) + span.duration
+        return totals
+
+    def server_timing(self, max_spans: int) -> str:
+        # Server-Timing names must be tokens, so the details go into desc
+        entries = [f'total;dur={self.duration * 1e3:.2f}']
+        for kind, seconds in self.totals().items():
+            entries.append(f'{kind};dur={seconds * 1e3:.2f}')
+        for index, span in enumerate(self.spans[:max_spans]):
+            entries.append(
+                f'{span.kind}-{index};dur={span.duration * 1e3:.2f}'
+                f';desc="{span.describe()}"'
+            )
+        return ', '.join(entries)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            'ms': round(self.duration * 1e3, 2),
+            'totals_ms': {
+                kind: round(seconds * 1e3, 2) for kind, seconds in self.totals().items()
+            },
+            'spans': [span.as_dict(self.start) for span in self.spans],
+        }
+
+
+_TRACE: ContextVar[Trace | None] = ContextVar('apcalt_trace', default=None)
+_SPAN: ContextVar[Span | None] = ContextVar('apcalt_span', default=None)
+
+
+def current_trace() -> Trace | None:
+    return _TRACE.get()
+
+
+@contextmanager
+def trace() -> Iterator[Trace]:
+    current = Trace()
+    token = _TRACE.set(current)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _TRACE.reset(token)
+
+
+def start_span(kind: str, name: str, host: str | None = None) -> Span | None:
+    # outside of a traced request nothing is recorded; the caller finishes it
+    current = _TRACE.get()
+    if current is None:
+        return None
+    new = Span(kind, name, host)
+    current.spans.append(new)
+    return new
+
+
+@contextmanager
+def span(kind: str, name: str, host: str | None = None) -> Iterator[Span | None]:
+    # add_bytes() inside the block is attributed to this span
+    new = start_span(kind, name, host)
+    if new is None:
+        yield None
+        return
+    token = _SPAN.set(new)
+    try:
+        yield new
+    finally:
+        new.finish()
+        _SPAN.reset(token)
+
+
+def add_bytes(size: int) -> None:
+    current = _SPAN.get()
+    if current is not None:
+        current.size = (current.size or 0) + size
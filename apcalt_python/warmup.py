@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+from typing import TYPE_CHECKING, Any
+
+from quart import Quart
+
+from .apc.api import APClassroom
+from .decorator import cache_key
+from .log import get_logger as _logger
+from .request import TokenBucket
+
+if TYPE_CHECKING:
+    from .apc.auth import APCAuth
+
+__all__ = ['AssignmentWarmer', 'init_warmup', 'warm_assignments']
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    # how many of the listed assignments to load ahead of time; 0 disables
+    'PREFETCH_ASSIGNMENTS': 0,
+    'PREFETCH_CONCURRENCY': 4,
+    # assignments started per second across all users
+    'PREFETCH_RATE': 2.0,
+    'PREFETCH_BURST': 4,
+}
+
+
+class AssignmentWarmer:
+    def __init__(
+        self, app: Quart, limit: int, concurrency: int, rate: float, burst: float
+    ):
+        self.app = app
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self._tasks: dict[Any, 'asyncio.Task[None]'] = {}
+
+    def schedule(
+        self, user_id: Any, api: APClassroom, subject_id: str, ids: list[str]
+    ) -> None:
+        # a new listing supersedes whatever is still queued for this user
+        self.cancel(user_id)
+        # run outside the request that scheduled it, which ends before the
+        # task does; a fresh context keeps its g, session and trace out of reach
+        task = asyncio.get_running_loop().create_task(
+            self._run(api, subject_id, ids[: self.limit]),
+            context=contextvars.Context(),
+        )
+
+        def done(task: 'asyncio.Task[None]') -> None:
+            if self._tasks.get(user_id) is task:
+                del self._tasks[user_id]
+
+        task.add_done_callback(done)
+        self._tasks[user_id] = task
+
+    async def _run(self, api: APClassroom, subject_id: str, ids: list[str]) -> None:
+        async with self.app.app_context():
+            # loading an assignment for the first time opens its player and
+            # creates the responses upstream, so only assignments the student
+            # has already opened here are warmed
+            keys = []
+            for id in ids:
+                keys.append(
+                    cache_key(APClassroom.get_assignment_raw, api, subject_id, id)
+                )
+                keys.append(api.opened_key(id))
+            cache = self.app.session_interface
+            values = await cache.get_many(keys, self.app)
+            await asyncio.gather(
+                *(
+                    self._warm(api, subject_id, id)
+                    for id, cached, opened in zip(ids, values[::2], values[1::2])
+                    if cached is None and opened is not None
+                )
+            )
+
+    async def _warm(self, api: APClassroom, subject_id: str, id: str) -> None:
+        await self.bucket.acquire()
+        async with self.semaphore:
+            try:
+                assignment = await api.get_assignment_raw(subject_id, id)
+                await assignment.get_question_auth()
+            except Exception:
+                _logger().debug('Failed to prefetch assignment %s', id, exc_info=True)
+
+    def cancel(self, user_id: Any) -> None:
+        # fetches that already started are shared with (and may be awaited by)
+        # regular requests, so only queued work is dropped
+        task = self._tasks.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+
+    def cancel_all(self) -> None:
+        for user_id in list(self._tasks):
+            self.cancel(user_id)
+
+
+WARMER: AssignmentWarmer | None = None
+
+
+def warm_assignments(auth: 'APCAuth', subject_id: str, assignments: Any) -> None:
+    if WARMER is None or not WARMER.limit:
+        return
+    ids = []
+    for item in assignments:
+        id = item.get('assignment_id', item.get('id'))
+        if id is not None:
+            ids.append(str(id))
+    if ids:
+        WARMER.schedule(auth.user_id, auth.api, subject_id, ids)
+
+
+def init_warmup(app: Quart) -> None:
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.before_serving
+    async def _start_warmer():
+        global WARMER
+        WARMER = AssignmentWarmer(
+            app,
+            app.config['PREFETCH_ASSIGNMENTS'],
+            app.config['PREFETCH_CONCURRENCY'],
+            app.config['PREFETCH_RATE'],
+            app.config['PREFETCH_BURST'],
+        )
+
+    @app.after_serving
+    async def _stop_warmer():
+        global WARMER
+        if WARMER is not None:
+            WARMER.cancel_all()
+            WARMER = None
@@ -0,0 +1,96 @@
+import random
+import string
+from copy import deepcopy
+
+__all__ = ['make_activity']
+
+_WORDS = (
+    'the function graph shown above which of following population rate increase '
+    'cell energy reaction model data table value derivative république économie —'
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _html(rng: random.Random, paragraphs: int) -> str:
+    return ''.join(
+        '<p>%s <span class="math">\\(x^{%d}\\)</span></p>'
+        % (_text(rng, rng.randint(20, 60)), rng.randint(1, 9))
+        for _ in range(paragraphs)
+    )
+
+
+def _ref(rng: random.Random) -> str:
+    return ''.join(rng.choice(string.hexdigits.lower()) for _ in range(32))
+
+
+def _question(rng: random.Random, index: int) -> dict:
+    response_id = _ref(rng)
+    options = [
+        {'label': _html(rng, 1), 'value': str(i)} for i in range(rng.randint(4, 5))
+    ]
+    return {
+        'response_id': response_id,
+        'type': 'mcq',
+        'stimulus': _html(rng, rng.randint(1, 4)),
+        'options': options,
+        'multiple_responses': False,
+        'title': 'Question %d' % (index + 1),
+        'metadata': {
+            'valid_response_count': 1,
+            'sheet_reference': _ref(rng),
+            'widget_reference': _ref(rng),
+            'source_reference': _ref(rng),
+        },
+        'validation': {
+            'scoring_type': 'exactMatch',
+            'valid_response': {'score': 1, 'value': [str(rng.randint(0, 3))]},
+        },
+        'ui_style': {'type': 'horizontal', 'choice_label': 'upper-alpha'},
+    }
+
+
+def make_activity(questions: int = 300, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    items = []
+    api_questions = []
+    for index in range(questions):
+        question = _question(rng, index)
+        # decoded from JSON upstream, so the two copies are distinct objects
+        api_questions.append(deepcopy(question))
+        features = []
+        if rng.random() < 0.3:
+            features.append({'type': 'sharedpassage', 'content': _html(rng, 6)})
+        items.append(
+            {
+                'reference': _ref(rng),
+                'source': {'reference': _ref(rng)},
+                'metadata': {'scoring_type': 'per-question', 'tags': []},
+                'response_ids': [question['response_id']],
+                'features': features,
+                'questions': [question],
+            }
+        )
+    return {
+        'meta': {'status': True, 'timestamp': 1700000000},
+        'data': {
+            'request': {'activity_id': _ref(rng), 'user_id': '12345678'},
+            'apiActivity': {
+                'title': 'Unit 3 Progress Check: MCQ',
+                'items': items,
+                'questionsApiActivity': {
+                    'consumer_key': _ref(rng)[:16],
+                    'timestamp': '20240101-0000',
+                    'user_id': '12345678',
+                    'signature': _ref(rng) * 2,
+                    'id': _ref(rng),
+                    'name': 'Unit 3 Progress Check: MCQ',
+                    'state': 'initial',
+                    'session_id': _ref(rng),
+                    'questions': api_questions,
+                },
+            },
+        },
+    }
@@ -0,0 +1,54 @@
+# Compare session/cache codecs on realistic Learnosity activities.
+#
+#     python -m benchmarks.bench_codecs
+
+import timeit
+from datetime import datetime, timezone
+
+from apcalt_python.apc.auth import APCAuth
+from apcalt_python.learnosity.assignment import Assignment
+from apcalt_python.sessions import CODECS
+
+from ._activity import make_activity
+
+
+def _auth() -> dict:
+    auth = APCAuth()
+    auth.data.update(
+        {
+            'cb_login': 'x' * 40,
+            'cb_user_name': 'student123',
+            'aws_expire': datetime.now(timezone.utc),
+            'account': {
+                'id': 12345678,
+                'import_id': 'abc123',
+                'access_token': 'y' * 900,
+                'expires': datetime.now(timezone.utc).isoformat(),
+            },
+        }
+    )
+    return {'auth': auth}
+
+
+def bench(label: str, value, number: int) -> None:
+    print(f'\n{label}')
+    print(f'{"codec":>8} {"bytes":>10} {"encode ms":>10} {"decode ms":>10}')
+    for name, codec in CODECS.items():
+        blob = codec.dumps(value)
+        encode = timeit.timeit(lambda: codec.dumps(value), number=number) / number
+        decode = timeit.timeit(lambda: codec.loads(blob), number=number) / number
+        print(f'{name:>8} {len(blob):>10} {encode * 1e3:>10.3f} {decode * 1e3:>10.3f}')
+
+
+def main() -> None:
+    bench('session with APCAuth', _auth(), 2000)
+    for questions in (20, 100, 400):
+        bench(
+            f'Assignment with {questions} questions',
+            Assignment(make_activity(questions)),
+            50,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Compare stdlib json with apcalt_python.jsoncodec on Learnosity payloads.
+#
+#     python -m benchmarks.bench_json
+
+import json
+import timeit
+
+from apcalt_python import jsoncodec
+
+from ._activity import make_activity
+
+
+def _std_loads(data: str):
+    return json.loads(data)
+
+
+def _std_dumps(obj) -> str:
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def _usrequest(activity: dict) -> dict:
+    questions = activity['data']['apiActivity']['questionsApiActivity']['questions']
+    return {
+        'submit': False,
+        'state': 'resume',
+        'user_id': '12345678',
+        'activity_id': activity['data']['request']['activity_id'],
+        'metadata': {
+            q['response_id']: {
+                'type': q['type'],
+                'question_reference': q['response_id'],
+            }
+            for q in questions
+        },
+        'questionResponses': [
+            {
+                'id': q['response_id'],
+                'response': {'value': [0], 'type': 'array', 'revision': 1},
+            }
+            for q in questions
+        ],
+        'metricsContext': ['itemsapi', 'assessapi'],
+    }
+
+
+def bench(label: str, func, arg, number: int) -> float:
+    seconds = timeit.timeit(lambda: func(arg), number=number) / number
+    print(f'  {label:<24} {seconds * 1e3:>10.3f} ms')
+    return seconds
+
+
+def main() -> None:
+    print(f'jsoncodec backend: {jsoncodec.BACKEND}')
+    for questions in (100, 300, 600):
+        activity = make_activity(questions)
+        text = _std_dumps(activity)
+        usrequest = _usrequest(activity)
+        assert jsoncodec.loads(text) == json.loads(text)
+        assert json.loads(jsoncodec.dumps(usrequest)) == usrequest
+        print(f'\n{questions} questions, {len(text.encode())} byte activity')
+        std = bench('decode activity json', _std_loads, text, 20)
+        fast = bench('decode activity codec', jsoncodec.loads, text, 20)
+        print(f'  {"speedup":<24} {std / fast:>10.2f} x')
+        std = bench('encode usrequest json', _std_dumps, usrequest, 50)
+        fast = bench('encode usrequest codec', jsoncodec.dumps, usrequest, 50)
+        print(f'  {"speedup":<24} {std / fast:>10.2f} x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# Simulate a classroom login storm against a local stand-in for the College
+# Board login hosts. By default only LOGIN_CONCURRENCY and LOGIN_QUEUE_TIMEOUT
+# apply, as in production; with `shaped`, the stand-ins for
+# account.collegeboard.org and prod.idp.collegeboard.org also get the
+# HTTP_HOST_LIMITS in SHAPED, so the throughput reported is what those allow.
+#
+#     python -m benchmarks.bench_login [logins] [login concurrency] [shaped]
+
+import asyncio
+import statistics
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from apcalt_python import request
+from apcalt_python.apc import auth
+from apcalt_python.app import build_app
+
+# one loopback name per upstream host, since the governors are per host name;
+# cookies are only kept for the named (non-IP) host
+ACCOUNT_HOST = 'localhost'
+IDP_HOST = '127.0.0.1'
+SUCRED_HOST = '127.0.0.2'
+PORT = 18052
+LATENCY = 0.03
+# the login-host limits suggested in the HTTP_HOST_LIMITS comment
+SHAPED = {'rate': 10, 'burst': 20, 'concurrency': 10}
+STATE_TOKEN = '00' + ''.join(f'\\x{ord(c):02x}' for c in 'state-token-') * 40
+
+
+def _quadratic_extract(page: str) -> str:
+    # the extractor used before, kept for comparison
+    start_idx = page.index('"stateToken":') + 14
+    end_idx = page.index('"', start_idx)
+    state_token = page[start_idx:end_idx]
+    while r'\x' in state_token:
+        idx = state_token.index(r'\x')
+        c = chr(int(state_token[idx + 2 : idx + 4], 16))
+        state_token = state_token[:idx] + c + state_token[idx + 4 :]
+    return state_token
+
+
+def _page() -> str:
+    filler = '<script>var x = 1;</script>' * 2000
+    return f'<html>{filler}<script>var oktaData = {{"stateToken":"{STATE_TOKEN}"}}</script></html>'
+
+
+async def _stub() -> web.AppRunner:
+    page = _page()
+    base = f'http://{ACCOUNT_HOST}:{PORT}'
+
+    async def login(request):
+        await asyncio.sleep(LATENCY)
+        return web.Response(text=page, content_type='text/html')
+
+    async def authn(request):
+        await asyncio.sleep(LATENCY)
+        body = await request.json()
+        assert body['stateToken'] == _quadratic_extract(page)
+        return web.json_response({'_links': {'next': {'href': f'{base}/redirect'}}})
+
+    async def redirect(request):
+        await asyncio.sleep(LATENCY)
+        response = web.Response(text='ok')
+        response.set_cookie('cb_login', 'login-' + str(id(request)))
+        return response
+
+    async def sucred(request):
+        await asyncio.sleep(LATENCY)
+        expiration = datetime.now(timezone.utc) + timedelta(hours=1)
+        return web.json_response(
+            {
+                'cbUserProfile': {
+                    'sessionInfo': {'identityKey': {'userName': 'student'}}
+                },
+                'catapult': {
+                    'Credentials': {
+                        'Expiration': expiration.strftime('%Y-%m-%dT%H:%M:%SZ')
+                    }
+                },
+            }
+        )
+
+    app = web.Application()
+    app.router.add_get('/login', login)
+    app.router.add_post('/authn', authn)
+    app.router.add_get('/redirect', redirect)
+    app.router.add_get('/sucred', sucred)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    for address in (IDP_HOST, SUCRED_HOST):
+        await web.TCPSite(runner, address, PORT).start()
+    auth.LOGIN_URL = f'{base}/login'
+    auth.AUTHN_URL = f'http://{IDP_HOST}:{PORT}/authn'
+    auth.COOKIE_URL = base
+    auth.SUCRED_URL = f'http://{SUCRED_HOST}:{PORT}/sucred'
+    return runner
+
+
+def _host_limits(shaped: bool) -> dict:
+    limits = dict(request.DEFAULT_CONFIG['HTTP_HOST_LIMITS'])
+    if shaped:
+        limits[ACCOUNT_HOST] = limits[IDP_HOST] = SHAPED
+    return limits
+
+
+async def storm(logins: int, concurrency: int, shaped: bool) -> None:
+    runner = await _stub()
+    limits = _host_limits(shaped)
+    app = build_app(
+        extra_config={
+            'LOGIN_CONCURRENCY': concurrency,
+            'HTTP_HOST_LIMITS': limits,
+            'TRACE_SERVER_TIMING': True,
+        }
+    )
+    latencies = []
+    waits = []
+    rejected = []
+    async with app.test_app():
+        client = app.test_client()
+
+        async def one():
+            start = time.monotonic()
+            response = await client.post(
+                '/auth/login', json={'username': 'student', 'password': 'pw'}
+            )
+            if response.status_code == 503:
+                rejected.append(response.headers['Retry-After'])
+                return
+            latencies.append(time.monotonic() - start)
+            assert response.status_code == 200, await response.get_data()
+            for entry in response.headers['Server-Timing'].split(', '):
+                if entry.startswith('queue-'):
+                    waits.append(float(entry.split('dur=')[1].split(';')[0]) / 1e3)
+
+        start = time.monotonic()
+        await asyncio.gather(*(one() for _ in range(logins)))
+        elapsed = time.monotonic() - start
+    await runner.cleanup()
+    latencies.sort()
+    print(f'{logins} logins, LOGIN_CONCURRENCY={concurrency}')
+    if shaped:
+        # the login page and the redirect both go to the account host
+        ceiling = SHAPED['rate'] / 2
+        print(f'  ceiling    {ceiling:8.1f} logins/s from HTTP_HOST_LIMITS')
+    print(f'  total      {elapsed:8.2f} s   ({len(latencies) / elapsed:.1f} logins/s)')
+    if rejected:
+        print(f'  rejected   {len(rejected):8d}     (503, Retry-After: {rejected[0]})')
+    print(f'  p50        {latencies[len(latencies) // 2] * 1e3:8.0f} ms')
+    print(f'  p95        {latencies[int(len(latencies) * 0.95)] * 1e3:8.0f} ms')
+    print(f'  queue mean {statistics.mean(waits) * 1e3:8.0f} ms')
+    print(f'  queue max  {max(waits) * 1e3:8.0f} ms')
+
+
+def extractor() -> None:
+    page = _page()
+    assert auth.extract_state_token(page) == _quadratic_extract(page)
+    for label, func in (
+        ('quadratic', _quadratic_extract),
+        ('regex', auth.extract_state_token),
+    ):
+        seconds = timeit.timeit(lambda: func(page), number=200) / 200
+        print(f'  {label:<10} {seconds * 1e6:8.1f} us')
+
+
+def main() -> None:
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    concurrency = (
+        int(sys.argv[2])
+        if len(sys.argv) > 2
+        else auth.DEFAULT_CONFIG['LOGIN_CONCURRENCY']
+    )
+    print(f'state token extraction ({STATE_TOKEN.count("x")} escapes)')
+    extractor()
+    shaped = len(sys.argv) > 3 and sys.argv[3] == 'shaped'
+    asyncio.run(storm(logins, concurrency, shaped))
+
+
+if __name__ == '__main__':
+    main()